@@ -10,15 +10,70 @@ configuration = {
                'run_async': True,
                'async_cores': 4,
                'cooldown': 30,
-               'no_work_timeout': 60
+               'no_work_timeout': 60,
+               'engine': 'iterative',
+               'prescreen': False,
+               # the cfs that run out of the budget are continued by slow_precision
+               # 'time_budget': 60
                },
+           # 'slow_precision': {
+           #     'args': { 'bulk': 20 },
+           #     'run_async': True,
+           #     'async_cores': 2,
+           #     'cooldown': 60,
+           #     'no_work_timeout': 300,
+           #     'engine': 'binary_split',
+           #     'time_budget': 3600
+           #     },
+           # 'deepen_precision': {
+           #     'args': { 'bulk': 1000 },
+           #     'run_async': True,
+           #     'async_cores': 4,
+           #     'cooldown': 30,
+           #     'no_work_timeout': 60,
+           #     'engine': 'iterative'
+           #     },
+           # 'deep_precision': {
+           #     'args': { 'bulk': 1, 'segments': 8 },
+           #     'run_async': True,
+           #     'async_cores': 8,
+           #     'cooldown': 30,
+           #     'no_work_timeout': 60
+           #     },
            'const_cf_pslq': {
                'args': { 'bulk': 1000, 'num_denom_factor': (2, True) },
                'run_async': True,
                'async_cores': 4,
                'cooldown': 30,
-               'no_work_timeout': 60
+               'no_work_timeout': 60,
+               'tiered_pslq': True,
+               'relation_screen_coeff': 0
                },
+           # 'const_cf_pslq_delta': {
+           #     'args': { 'bulk': 2000 },
+           #     'run_async': True,
+           #     'async_cores': 2,
+           #     'cooldown': 300,
+           #     'no_work_timeout': 600
+           #     },
+           # 'derive_connections': {
+           #     'args': { 'bulk': 1000 },
+           #     'cooldown': 600,
+           #     'no_work_timeout': 600
+           #     },
+           # 'cf_to_cf_pslq': {
+           #     'args': { 'bulk': 500 },
+           #     'run_async': True,
+           #     'async_cores': 4,
+           #     'split_async': False,
+           #     'cooldown': 30,
+           #     'no_work_timeout': 60,
+           #     'tiered_pslq': True,
+           #     'fingerprint_index': False,
+           #     'fingerprint_coeff': 2,
+           #     'index_coeff': 1,
+           #     'relation_screen_coeff': 0
+           #     },
             }
         }
 
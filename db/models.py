@@ -45,9 +45,12 @@ class Cf(Base):
     partial_denominator = Column(ARRAY(Numeric()), nullable=False)
     family_id = Column(ForeignKey('cf_family.family_id'))
     scanned_algo = Column(JSONB(astext_type=Text()))
+    canonical_id = Column(ForeignKey('cf.cf_id'))
+    canonical_transform = Column(JSONB(astext_type=Text()))
 
     family = relationship('CfFamily')
     precision_data = relationship('CfPrecision', uselist=False, lazy='joined')
+    canonical = relationship('Cf', remote_side=[cf_id], lazy='select')
 
 
 class CfPrecision(Base):
@@ -2,8 +2,9 @@ import logging
 import config
 from sqlalchemy.orm import sessionmaker
 from . import models
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, and_, or_, null
 from sqlalchemy.dialects import postgresql
+from jobs import canonical_utils
 
 class RamanujanDB(object):
     def __init__(self):
@@ -22,11 +23,70 @@ class RamanujanDB(object):
         return self.session.query(models.Cf)
 
     def add_cfs(self, cf_list, conflict=False):
-        if not conflict:
-            self.session.add_all(cf_list)
+        """
+        Adds the cfs together with their canonical forms in a single transaction. A cf that
+        is already in the db, for example as the canonical form of another cf, is skipped.
+        """
+        try:
+            self.add_canonical_forms(cf_list)
+            if not conflict:
+                existing = self.get_cf_ids([self.get_key(cf) for cf in cf_list])
+                self.session.add_all([models.Cf(**cf) if isinstance(cf, dict) else cf for cf in cf_list if self.get_key(cf) not in existing])
+            else:
+                insert_statement = postgresql.insert(models.Cf).values(cf_list)
+                self.session.execute(insert_statement.on_conflict_do_nothing())
             self.session.commit()
-        else:
-            insert_statement = postgresql.insert(models.Cf).values(cf_list)
-            self._engine.execute(insert_statement.on_conflict_do_nothing())
+        except Exception:
+            self.session.rollback()
+            raise
 
+    @staticmethod
+    def get_key(cf):
+        num, denom = (cf['partial_numerator'], cf['partial_denominator']) if isinstance(cf, dict) else (cf.partial_numerator, cf.partial_denominator)
+        return tuple(int(i) for i in num), tuple(int(i) for i in denom)
 
+    def get_cf_ids(self, keys):
+        """
+        The cf_id of every (numerator, denominator) key that is in the db.
+        """
+        cf_ids = {}
+        if not keys:
+            return cf_ids
+        query = self.session.query(models.Cf.cf_id, models.Cf.partial_numerator, models.Cf.partial_denominator).filter(
+                or_(*[and_(models.Cf.partial_numerator == list(num), models.Cf.partial_denominator == list(denom)) for num, denom in keys]))
+        for cf_id, num, denom in query:
+            cf_ids[(tuple(int(i) for i in num), tuple(int(i) for i in denom))] = cf_id
+        return cf_ids
+
+    def add_canonical_forms(self, cf_list):
+        """
+        Makes sure that the canonical form of every cf is in the db, and points the cfs
+        that aren't canonical to it. cf_list holds either models.Cf objects or dicts. The
+        canonical forms are inserted in the session's transaction, the caller commits it.
+        """
+        transforms = []
+        for cf in cf_list:
+            if isinstance(cf, dict):
+                # every row of a multi row insert needs the same keys
+                cf.setdefault('canonical_id', None)
+                cf.setdefault('canonical_transform', null())
+            num, denom = self.get_key(cf)
+            canonical_num, canonical_denom, scale, shift = canonical_utils.canonicalize(num, denom)
+            if (canonical_num, canonical_denom) != (list(num), list(denom)):
+                transforms.append((cf, (tuple(canonical_num), tuple(canonical_denom)), {'scale': scale, 'shift': shift}))
+        if not transforms:
+            return
+
+        canonical_forms = list({key for _, key, _ in transforms})
+        insert_statement = postgresql.insert(models.Cf).values(
+                [{'partial_numerator': list(num), 'partial_denominator': list(denom)} for num, denom in canonical_forms])
+        self.session.execute(insert_statement.on_conflict_do_nothing())
+
+        canonical_ids = self.get_cf_ids(canonical_forms)
+        for cf, key, transform in transforms:
+            if isinstance(cf, dict):
+                cf['canonical_id'] = canonical_ids[key]
+                cf['canonical_transform'] = transform
+            else:
+                cf.canonical_id = canonical_ids[key]
+                cf.canonical_transform = transform
@@ -0,0 +1,52 @@
+import math
+import logging
+
+import mpmath
+
+# the big integer arithmetic of the jobs runs on gmpy2 when it is installed, and on python
+# ints otherwise. mpmath picks gmpy2 by itself when it is installed, so pslq gets it too
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+GMPY2_BACKEND = 'gmpy2'
+PYTHON_BACKEND = 'python'
+
+BACKEND = GMPY2_BACKEND if gmpy2 else PYTHON_BACKEND
+
+if gmpy2:
+    def to_int(x):
+        return gmpy2.mpz(int(x))
+
+    def gcd(first, second):
+        return gmpy2.gcd(first, second)
+
+    def log10(x):
+        return float(gmpy2.log10(x))
+
+    def log2(x):
+        return float(gmpy2.log2(x))
+else:
+    def to_int(x):
+        return int(x)
+
+    gcd = math.gcd
+    log10 = math.log10
+    log2 = math.log2
+
+def self_check():
+    """
+    Compares the backend to python ints on a few big numbers. Returns True if they agree.
+    """
+    first = 3**500 * 2**300
+    second = 3**400 * 5**200
+    if int(gcd(to_int(first), to_int(second))) != 3**400:
+        return False
+    if abs(log2(to_int(first)) - math.log2(first)) > 1e-9 or abs(log10(to_int(second)) - math.log10(second)) > 1e-9:
+        return False
+    return int(to_int(first) * to_int(second) // to_int(3**900)) == 2**300 * 5**200
+
+def log_backend(logger_name):
+    check = 'passed' if self_check() else 'FAILED'
+    logging.getLogger(logger_name).info(f'arithmetic backend: {BACKEND}, mpmath backend: {mpmath.libmp.BACKEND}, self check {check}')
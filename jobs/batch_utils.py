@@ -0,0 +1,38 @@
+import numpy as np
+from jobs.poly_utils import PolyIterator
+
+INT64_LIMIT = 2**63 - 1
+
+def get_poly_values(coeff_lists, start, end):
+    """
+    Evaluates every polynomial at n = start, ..., end-1 with one int64 matrix product.
+    Polynomials whose values might overflow int64 are evaluated with python ints instead.
+    Returns an object array of python ints, with a row per polynomial.
+    """
+    width = max([len(coeffs) for coeffs in coeff_lists] + [1])
+    max_n = max(abs(start), abs(end - 1))
+    values = np.empty((len(coeff_lists), end - start), dtype=object)
+
+    fits = []
+    if max_n ** (width - 1) < INT64_LIMIT:
+        for row, coeffs in enumerate(coeff_lists):
+            bound = sum([abs(coeff) * max_n**(len(coeffs) - 1 - idx) for idx, coeff in enumerate(coeffs)])
+            if bound < INT64_LIMIT:
+                fits.append(row)
+
+    if fits:
+        coeff_matrix = np.zeros((len(fits), width), dtype=np.int64)
+        for idx, row in enumerate(fits):
+            coeffs = coeff_lists[row]
+            if coeffs:
+                coeff_matrix[idx, width - len(coeffs):] = coeffs
+        powers = np.array([[n**k for n in range(start, end)] for k in range(width - 1, -1, -1)], dtype=np.int64)
+        values[fits] = (coeff_matrix @ powers).astype(object)
+
+    fitting = set(fits)
+    for row, coeffs in enumerate(coeff_lists):
+        if row not in fitting:
+            poly_iter = PolyIterator(coeffs, start)
+            values[row] = [next(poly_iter) for _ in range(start, end)]
+
+    return values
@@ -0,0 +1,105 @@
+import math
+
+from jobs.poly_utils import calculate_poly_depth, shift_poly
+from jobs.matrix_utils import mat_mul, product_tree
+
+# Cfs that are the same up to a simple transform are calculated once. With the numerator
+# b(n) and the denominator a(n):
+# - scale: b(n) -> c^2 * b(n), a(n) -> c * a(n) multiplies the value by c (c = -1 negates it)
+# - shift: b(n) -> b(n + k), a(n) -> a(n + k) is the k-th tail of the cf
+# The canonical form has the biggest scale taken out, a positive leading coefficient in
+# the denominator and the shift that puts its second coefficient in [0, deg*lead).
+
+def strip(coeff_list):
+    coeff_list = [int(coeff) for coeff in coeff_list]
+    while coeff_list and coeff_list[0] == 0:
+        coeff_list = coeff_list[1:]
+    return coeff_list
+
+def get_content(coeff_list):
+    content = 0
+    for coeff in coeff_list:
+        content = math.gcd(content, coeff)
+    return content
+
+def get_scale(num, denom):
+    """
+    The biggest c such that c divides denom and c^2 divides num, with the sign of the
+    leading coefficient of denom.
+    """
+    if not denom:
+        return 1
+    denom_content = get_content(denom)
+    num_content = get_content(num)
+    scale = max([c for c in range(1, denom_content + 1) if denom_content % c == 0 and num_content % (c*c) == 0])
+    return scale if denom[0] > 0 else -scale
+
+def get_shift(num, denom):
+    """
+    The shift that puts the second coefficient of denom (or of num, if denom is constant)
+    in [0, |deg*lead|).
+    """
+    for coeff_list in [denom, num]:
+        if len(coeff_list) > 1:
+            step = (len(coeff_list) - 1) * coeff_list[0]
+            sign = 1 if step > 0 else -1
+            return -(coeff_list[1] // abs(step)) * sign
+    return 0
+
+def is_connected(num, start, end):
+    """
+    A tail is only equivalent to the cf when no partial numerator in between is 0,
+    otherwise the value of the cf doesn't depend on it.
+    """
+    return all([calculate_poly_depth(num, n) != 0 for n in range(start, end)])
+
+def canonicalize(num, denom):
+    """
+    Returns the canonical numerator and denominator of the cf, and the scale and shift
+    that take it there.
+    """
+    num, denom = strip(num), strip(denom)
+    scale = get_scale(num, denom)
+    num = [coeff // (scale*scale) for coeff in num]
+    denom = [coeff // scale for coeff in denom]
+
+    shift = get_shift(num, denom)
+    if not is_connected(num, min(shift, 0) + 1, max(shift, 0) + 1):
+        shift = 0
+    return shift_poly(num, shift), shift_poly(denom, shift), scale, shift
+
+def get_tail_matrix(num, denom, k):
+    """
+    The matrix M such that value = (M00*t + M01) / (M10*t + M11), where t is the value
+    of the k-th tail of the cf.
+    """
+    steps = [(1, calculate_poly_depth(denom, 0), 0, 1)]
+    steps += [(0, calculate_poly_depth(num, n), 1, calculate_poly_depth(denom, n)) for n in range(1, k)]
+    steps.append((0, calculate_poly_depth(num, k), 1, 0))
+    return product_tree(steps)
+
+def get_transform_matrix(num, denom, scale, shift):
+    """
+    The matrix T such that the value of the original cf is (T00*t + T01) / (T10*t + T11),
+    where t is the value of its canonical form (num, denom).
+    """
+    if shift > 0:
+        matrix = get_tail_matrix(shift_poly(num, -shift), shift_poly(denom, -shift), shift)
+    elif shift < 0:
+        m00, m01, m10, m11 = get_tail_matrix(num, denom, -shift)
+        matrix = (m11, -m01, -m10, m00)
+    else:
+        matrix = (1, 0, 0, 1)
+    return mat_mul((scale, 0, 0, 1), matrix)
+
+def derive_calc(num, denom, scale, shift, previous_calc):
+    """
+    Turns the state of the canonical form (num, denom) into the state of the original cf,
+    shift steps deeper. Both are [a0, b0, a1, b1] lists.
+    """
+    a0, b0, a1, b1 = [int(x) for x in previous_calc]
+    state = mat_mul(get_transform_matrix(num, denom, scale, shift), (a0, a1, b0, b1))
+    # the scale multiplies every convergent of the original cf by another c
+    a0, a1, b0, b1 = mat_mul(state, (1, 0, 0, scale))
+    gcd_reduce = get_content([a0, b0, a1, b1]) or 1
+    return [a0 // gcd_reduce, b0 // gcd_reduce, a1 // gcd_reduce, b1 // gcd_reduce]
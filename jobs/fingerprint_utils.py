@@ -0,0 +1,62 @@
+import math
+import itertools
+
+import mpmath as mp
+
+# Two values are related by y = (a*x + b) / (c*x + d) when T(y) = S(x) for some pair of
+# small integer matrices T, S (then the relation is T^-1 * S). The index holds T(y) of every
+# value under the index transforms, and a value x is looked up under its query transforms.
+# The fingerprint of a value is the fractional part truncated to FINGERPRINT_DIGITS, so
+# integer translations don't matter either.
+FINGERPRINT_DPS = 40
+FINGERPRINT_DIGITS = 25
+FINGERPRINT_MODULUS = 10 ** FINGERPRINT_DIGITS
+
+def get_transforms(max_coeff):
+    """
+    The invertible 2x2 integer matrices with coefficients up to max_coeff, one of every
+    M, -M and without a common factor, as row-major tuples.
+    """
+    transforms = []
+    for matrix in itertools.product(range(-max_coeff, max_coeff + 1), repeat=4):
+        a, b, c, d = matrix
+        if a*d - b*c == 0 or math.gcd(math.gcd(a, b), math.gcd(c, d)) != 1:
+            continue
+        if next(coeff for coeff in matrix if coeff != 0) < 0:
+            continue
+        transforms.append(matrix)
+    return transforms
+
+def get_value(p, q):
+    with mp.workdps(FINGERPRINT_DPS):
+        return mp.mpf(str(p)) / mp.mpf(str(q))
+
+def get_fingerprint(value, transform):
+    a, b, c, d = transform
+    with mp.workdps(FINGERPRINT_DPS):
+        value = (a*value + b) / (c*value + d)
+        return int(mp.floor(mp.frac(value) * FINGERPRINT_MODULUS))
+
+class FingerprintIndex(object):
+    def __init__(self, index_coeff=1):
+        self.transforms = get_transforms(index_coeff)
+        self.index = {}
+
+    def add(self, key, value):
+        for transform in self.transforms:
+            self.index.setdefault(get_fingerprint(value, transform), []).append(key)
+
+    def find(self, value, transforms):
+        """
+        The keys of the values that might be related to value under the query transforms.
+        The neighbouring fingerprints are looked up too, in case the truncation differs.
+        """
+        keys = set()
+        for transform in transforms:
+            fingerprint = get_fingerprint(value, transform)
+            for neighbour in [fingerprint - 1, fingerprint, fingerprint + 1]:
+                keys.update(self.index.get(neighbour % FINGERPRINT_MODULUS, []))
+        return keys
+
+    def size(self):
+        return sum([len(keys) for keys in self.index.values()])
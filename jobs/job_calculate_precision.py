@@ -5,14 +5,25 @@ import numpy as np
 import mpmath
 from decimal import Decimal, getcontext
 from collections import namedtuple
+from fractions import Fraction
 from dataclasses import dataclass, asdict
 from enum import Enum
 import time
 import os
+from datetime import datetime
 
+import config
 from db import ramanujan_db
 from db import models
-
+from jobs.poly_utils import SEQUENCE_CACHE, calculate_poly_depth
+from jobs.matrix_utils import product_tree
+from jobs import prescreen_utils
+from jobs import batch_utils
+from jobs import arith_backend
+from jobs import canonical_utils
+from jobs import wire_utils
+
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import func
 
 getcontext().prec = 2000
@@ -24,9 +35,35 @@ FR_THRESHOLD = 0.1
 CALC_JUMP = 200
 REDUCE_JUMP = 100
 PRECISION_FILTER = 50
+MAX_PRECISION = 2000
+VALUE_GUARD_BITS = 64
+LOG10_2 = math.log10(2)
+LOG2_10 = math.log2(10)
+TARGET_PRECISION = 2000
+STAGNATION_CHECKPOINTS = 3
+MIN_PRECISION_GAIN = 1
+MIN_REDUCE_JUMP = 25
+MAX_REDUCE_JUMP = 1600
+HIGH_REDUCTION_GAIN = 0.1
+LOW_REDUCTION_GAIN = 0.01
+LOG2_E = math.log2(math.e)
+RATIONAL_PRECISION = 100
+MIN_RATIONAL_PRECISION = 20
+RATIONAL_MAX_COEFF = 1000
 LOGGER_NAME = 'job_logger'
+JOB_NAME = 'calculate_precision'
+
+ITERATIVE_ENGINE = 'iterative'
+BINARY_SPLIT_ENGINE = 'binary_split'
+BATCH_ENGINE = 'batch'
 
-FILTERS = [models.Cf.precision_data == None]
+FILTERS = [models.Cf.precision_data == None, models.Cf.canonical_id == None]
+# cfs that aren't canonical get their precision data from their canonical form once it has one
+DERIVE_FILTERS = [
+        models.Cf.precision_data == None,
+        models.Cf.canonical_id != None,
+        models.Cf.canonical.has(models.Cf.precision_data != None)
+        ]
 
 def get_filters(num_denom_factor):
     filters = FILTERS
@@ -50,6 +87,19 @@ def get_filters(num_denom_factor):
 
     return filters
 
+def get_job_config(job_name=JOB_NAME):
+    return config.configuration['jobs_to_run'].get(job_name, {})
+
+def get_calc_config(job_name=JOB_NAME):
+    job_config = get_job_config(job_name)
+    return {
+            'engine': job_config.get('engine', ITERATIVE_ENGINE),
+            'reduce_jump': job_config.get('reduce_jump', REDUCE_JUMP),
+            'calc_jump': job_config.get('calc_jump', CALC_JUMP),
+            'time_budget': job_config.get('time_budget', False),
+            'size_budget': job_config.get('size_budget', False)
+            }
+
 class PrecisionType(Enum):
     HIGH_PREC = 1
     LOW_PREC = 2
@@ -68,58 +118,200 @@ class CfData:
     original_value: str = ''
     converges: bool = True
     reduction: int = 0
+    convergence_rate: float = 0
+    stop_reason: str = ''
+    prescreened: bool = False
+    calc_depth: int = 0
+    derived_from: str = ''
+    timed_out: bool = False
+
+class StopReason(object):
+    DEPTH = 'depth'
+    TARGET_PRECISION = 'target_precision'
+    DIVERGING = 'diverging'
+    STAGNANT = 'stagnant'
+    ZERO_DENOMINATOR = 'zero_denominator'
+    SLOW = 'slow'
+    TIMED_OUT = 'timed_out'
 
 CalcData = namedtuple('CalcData', ['a0', 'b0', 'a1', 'b1'])
 
 class CfCalc(object):
-    def __init__(self, num, denom, previous_calc):
+    def __init__(self, num, denom, previous_calc, engine=ITERATIVE_ENGINE):
         self.num = num
         self.denom = denom
-        self.reduction = 1
+        self.engine = engine
+        # the number of bits removed from the state by the reductions so far
+        self.reduction = 0
         if not previous_calc:
-            self.data = CalcData(1, 0, CfCalc.calculate_poly_depth(denom, 0), 1)
+            self.data = CalcData(*[arith_backend.to_int(i) for i in [1, 0, CfCalc.calculate_poly_depth(denom, 0), 1]])
         else:
-            self.data = CalcData(*previous_calc)
+            self.data = CalcData(*[arith_backend.to_int(i) for i in previous_calc])
+        # log10 of |a0*b1 - a1*b0|, every step multiplies it by the partial numerator
+        det = self.data.a0*self.data.b1 - self.data.a1*self.data.b0
+        self.log_det = arith_backend.log10(abs(det)) if det else -math.inf
+        self.reduced_size = self.get_size()
 
-    def calc_iter(self, i, try_reduce=True):
-        a = CfCalc.calculate_poly_depth(self.num, i+1)
-        b = CfCalc.calculate_poly_depth(self.denom, i+1)
+    def poly_values(self, n):
+        return self.get_poly_values(n, n + 1)[0]
+
+    def get_poly_values(self, start, end):
+        """
+        The values of the numerator and the denominator at start, ..., end-1, as pairs.
+        """
+        return list(zip(SEQUENCE_CACHE.get_values(self.num, start, end), SEQUENCE_CACHE.get_values(self.denom, start, end)))
+
+    def step(self, a, b):
+        self.log_det += math.log10(abs(a)) if a else -math.inf
 
         p = b*self.data.a1 + a*self.data.a0
         q = b*self.data.b1 + a*self.data.b0
 
-        data = CalcData(self.data.a1, self.data.b1, p, q)
+        self.data = CalcData(self.data.a1, self.data.b1, p, q)
+        return p, q
 
+    def calc_iter(self, i, try_reduce=True):
+        return self.calc_range(i, i + 1, try_reduce)
+
+    def calc_range(self, start, end, try_reduce=True):
+        """
+        Same as calling calc_iter for every i in range(start, end), when only the last
+        iteration tries to reduce.
+        """
+        if self.engine != BINARY_SPLIT_ENGINE or end - start < 2:
+            for a, b in self.get_poly_values(start + 1, end + 1):
+                p, q = self.step(a, b)
+        else:
+            p, q = self.apply_matrix(*self.get_segment_matrix(start, end))
         if try_reduce:
-            gcd_reduce = math.gcd(math.gcd(self.data.a1, self.data.b1), math.gcd(p, q))
-            self.reduction *= gcd_reduce
-            data = CalcData(self.data.a1 // gcd_reduce, self.data.b1 // gcd_reduce, p // gcd_reduce, q // gcd_reduce)
-        
-        self.data = data 
+            self.reduce()
         return p, q
 
+    def get_segment_matrix(self, start, end):
+        """
+        Multiplies the step matrices of the depths start, ..., end-1 by divide and conquer.
+        Returns the product and the log10 of the absolute value of its determinant.
+        """
+        steps = []
+        log_det = 0
+        for a, b in self.get_poly_values(start + 1, end + 1):
+            log_det += math.log10(abs(a)) if a else -math.inf
+            steps.append((0, a, 1, b))
+        return product_tree(steps), log_det
+
+    def apply_matrix(self, matrix, log_det):
+        """
+        Multiplies the state by a product of step matrices, returns the new p and q.
+        """
+        m00, m01, m10, m11 = matrix
+        self.log_det += log_det
+        a0 = self.data.a0*m00 + self.data.a1*m10
+        b0 = self.data.b0*m00 + self.data.b1*m10
+        p = self.data.a0*m01 + self.data.a1*m11
+        q = self.data.b0*m01 + self.data.b1*m11
+
+        self.data = CalcData(a0, b0, p, q)
+        return p, q
+
+    def reduce(self, pq_gcd=None):
+        """
+        Divides the state by the gcd of its entries. pq_gcd is gcd(a1, b1), if it was
+        already calculated. Returns the number of bits the state grew since the last
+        reduction, and the number of bits this one removed.
+        """
+        if pq_gcd is None:
+            pq_gcd = arith_backend.gcd(self.data.a1, self.data.b1)
+        gcd_reduce = arith_backend.gcd(arith_backend.gcd(self.data.a0, self.data.b0), pq_gcd)
+        size = self.get_size()
+        grown_bits = size - self.reduced_size
+        removed_bits = arith_backend.log2(gcd_reduce) if gcd_reduce else 0
+        if gcd_reduce > 1:
+            self.reduction += removed_bits
+            self.log_det -= 2 * arith_backend.log10(gcd_reduce)
+            self.data = CalcData(*[x // gcd_reduce for x in self.data])
+            size = self.get_size()
+        self.reduced_size = size
+        return grown_bits, removed_bits
+
+    def get_size(self):
+        return max(abs(x).bit_length() for x in self.data)
+
     @property
     def value(self):
-        return Decimal(self.data.a1) / self.data.b1
+        return self.get_value(getcontext().prec)
+
+    def get_value(self, digits):
+        """
+        a1 / b1 as a Decimal with the given number of digits after the decimal point.
+        Only the top bits of a1 and b1 are needed for that, so they are shifted down first.
+        """
+        numerator, denominator = abs(self.data.a1), abs(self.data.b1)
+        shift = min(numerator.bit_length(), denominator.bit_length()) - math.ceil(max(digits, 0) * LOG2_10) - VALUE_GUARD_BITS
+        if shift > 0:
+            numerator, denominator = numerator >> shift, denominator >> shift
+        scaled = numerator * 10**max(digits, 0) // denominator
+        sign = -1 if (self.data.a1 < 0) != (self.data.b1 < 0) else 1
+        return Decimal(int(sign * scaled)).scaleb(-max(digits, 0))
 
     @property
     def precision(self):
+        """
+        floor(-log10|a1/b1 - a0/b0|), computed on integers as floor(log10(|b0*b1| / |a1*b0 - a0*b1|)).
+        Precisions that the 2000 digits value can't hold are returned as inf.
+        """
         if self.data.b0 == 0 or self.data.b1 == 0:
             return False, 0
 
-        precision = -1 * abs(self.value - Decimal(self.data.a0)/self.data.b0).log10()
-        
-        if precision != math.inf:
-            precision = math.floor(precision)
+        det = abs(self.data.a1*self.data.b0 - self.data.a0*self.data.b1)
+        if det == 0:
+            return True, math.inf
+
+        precision = floor_log10_ratio(abs(self.data.b0*self.data.b1), det)
+        magnitude = floor_log10_ratio(abs(self.data.a1), abs(self.data.b1)) + 1 if self.data.a1 else 0
+        if precision >= MAX_PRECISION - max(magnitude, 0):
+            return True, math.inf
 
         return True, precision
+
+    def estimate_precision(self):
+        """
+        Cheap estimate of the precision from the sizes of the state, to follow the
+        trend while calculating. Returns None if a denominator is 0.
+        """
+        if self.data.b0 == 0 or self.data.b1 == 0:
+            return None
+        if self.log_det == -math.inf:
+            return math.inf
+
+        return arith_backend.log10(abs(self.data.b0)) + arith_backend.log10(abs(self.data.b1)) - self.log_det
     
     def get_calc_data(self):
-        return [self.data.a0, self.data.b0, self.data.a1, self.data.b1]
+        return [int(x) for x in self.data]
 
     @staticmethod
     def calculate_poly_depth(coeff_list, n):
-        return sum([coeff*n**(len(coeff_list)-1-idx) for idx, coeff in enumerate(coeff_list)])
+        return calculate_poly_depth(coeff_list, n)
+
+def floor_log10_ratio(numerator, denominator):
+    """
+    floor(log10(numerator / denominator)) for positive integers, the bit lengths give
+    the answer up to 1 and the exact comparisons fix it.
+    """
+    def at_least(k):
+        if k >= 0:
+            return numerator >= denominator * 10**k
+        return numerator * 10**-k >= denominator
+
+    k = math.floor((numerator.bit_length() - denominator.bit_length()) * LOG10_2)
+    while not at_least(k):
+        k -= 1
+    while at_least(k + 1):
+        k += 1
+    return k
+
+def is_almost_zero(p, q):
+    """Same as mpmath.almosteq(0, p / q) in the working precision"""
+    return abs(p) << (mpmath.mp.prec - 4) <= abs(q)
 
 def get_poly_deg(coeff_list):
     first_nonzero = [i for i,e in enumerate(coeff_list) if e != 0]
@@ -128,6 +320,56 @@ def get_poly_deg(coeff_list):
     else:
         return 0
 
+def get_leading_coeff(coeff_list):
+    return next((coeff for coeff in coeff_list if coeff != 0), 0)
+
+def estimate_convergence_rate(num, denom, depth):
+    """
+    Estimates how many digits every step adds, from the degrees and leading coefficients
+    of the partial numerator and denominator. A denominator of degree d against a
+    numerator of degree below 2d converges super exponentially, so the rate is taken
+    at the given depth. When the numerator is of degree 2d the rate is set by the roots
+    of x^2 = denom_lead*x + num_lead, and otherwise there is no geometric convergence.
+    The estimate is only recorded in general_data, the checkpoints decide when to stop.
+    """
+    num_lead = get_leading_coeff(num)
+    denom_lead = get_leading_coeff(denom)
+    if num_lead == 0 or denom_lead == 0:
+        return 0
+
+    num_deg = get_poly_deg(num)
+    denom_deg = get_poly_deg(denom)
+    if num_deg < 2 * denom_deg:
+        rate = (2 * denom_deg - num_deg) * math.log10(max(depth, 1)) - math.log10(abs(num_lead) / denom_lead**2)
+    elif num_deg == 2 * denom_deg:
+        disc = denom_lead**2 + 4 * num_lead
+        if disc <= 0:
+            return 0
+        big_root = (abs(denom_lead) + math.sqrt(disc)) / 2
+        small_root = abs(abs(denom_lead) - math.sqrt(disc)) / 2
+        rate = math.log10(big_root / small_root) if small_root else 0
+    else:
+        return 0
+
+    return max(rate, 0)
+
+def get_stop_reason(precisions, target_precision):
+    """
+    Decides if the calculation can stop, according to the precision estimates
+    from the checkpoints so far. Returns None if it should go on.
+    """
+    if precisions[-1] >= target_precision:
+        return StopReason.TARGET_PRECISION
+
+    if len(precisions) >= 3 and precisions[-1] < precisions[-2] < precisions[-3] and precisions[-1] < 0:
+        return StopReason.DIVERGING
+
+    if len(precisions) > STAGNATION_CHECKPOINTS and \
+            precisions[-1] - precisions[-1 - STAGNATION_CHECKPOINTS] < MIN_PRECISION_GAIN:
+        return StopReason.STAGNANT
+
+    return None
+
 def check_fr(fr_list):
     for i in range(1, len(fr_list)):
         if abs(fr_list[i] - fr_list[i-1]) < FR_THRESHOLD:
@@ -139,61 +381,281 @@ def check_fr(fr_list):
 
     return 0.5
 
-def check_rational(p, q):
-    val = mpmath.mpf(p) / mpmath.mpf(q)
-    if mpmath.almosteq(p, 0) or mpmath.almosteq(val, 0):
+def check_rational(p, q, precision=RATIONAL_PRECISION):
+    """
+    Returns 1 if p / q is a rational number with small coefficients, up to the digits
+    that the precision of the cf allows. The best candidate is the last convergent of
+    the continued fraction expansion of p / q with a small enough denominator, and it
+    is checked on integers.
+    """
+    if p == 0 or is_almost_zero(p, q):
         logging.getLogger(LOGGER_NAME).debug(f'Checking rational that is too close to 0 p={p},q={q}')
         return 1
-    
-    if mpmath.pslq([val, 1], tol=mpmath.power(10, -100)):
+
+    digits = min(precision, RATIONAL_PRECISION)
+    if digits < MIN_RATIONAL_PRECISION:
+        return 0
+
+    candidate = Fraction(int(p), int(q)).limit_denominator(RATIONAL_MAX_COEFF)
+    if abs(candidate.numerator) > RATIONAL_MAX_COEFF:
+        return 0
+    # |p/q - n/d| < 10^-digits
+    if abs(p * candidate.denominator - q * candidate.numerator) * 10**digits < abs(q * candidate.denominator):
         return 1
     return 0
 
-def calculate_cf(num, denom, depth_diff, previous_calc=None, verbose=False, skip=1, reduce_jump=False):
-    num = [int(i) for i in num]
-    denom = [int(i) for i in denom]
-    if not reduce_jump:
-        reduce_jump = REDUCE_JUMP
-    
-    precision = 0
-    depth = depth_diff
-    cf_calc = CfCalc(num, denom, previous_calc)
-    
+class ReductionSchedule(object):
+    """
+    Decides in which depths calculate_cf reduces the state. Every calc_jump checkpoint
+    and the last depth are reduced since gcd(p, q) is calculated there anyway, and in
+    between the reduction interval adapts to the share of the grown bits that the
+    reductions manage to remove - cfs with big common factors get reduced more often,
+    and cfs without them are left alone.
+    """
+    def __init__(self, start_depth, end_depth, reduce_jump, calc_jump):
+        self.start_depth = start_depth
+        self.end_depth = end_depth
+        self.reduce_jump = reduce_jump
+        self.calc_jump = calc_jump
+        self.next_reduce = start_depth + reduce_jump
+
+    def __iter__(self):
+        i = self.start_depth - 1
+        while i < self.end_depth - 1:
+            next_check_point = max((i // self.calc_jump + 1) * self.calc_jump, self.calc_jump)
+            i = min(self.next_reduce, next_check_point, self.end_depth - 1)
+            yield i
+
+    def is_check_point(self, i):
+        return i % self.calc_jump == 0 and i != 0
+
+    def should_reduce(self, i):
+        return i >= self.next_reduce or self.is_check_point(i) or i == self.end_depth - 1
+
+    def update(self, i, grown_bits, removed_bits):
+        if grown_bits > 0:
+            gain = removed_bits / grown_bits
+            if gain >= HIGH_REDUCTION_GAIN:
+                self.reduce_jump = max(self.reduce_jump // 2, MIN_REDUCE_JUMP)
+            elif gain < LOW_REDUCTION_GAIN:
+                self.reduce_jump = min(self.reduce_jump * 2, MAX_REDUCE_JUMP)
+        self.next_reduce = i + self.reduce_jump
+
+def init_cf_data(num, denom, end_depth):
     data = CfData(bn_deg=get_poly_deg(num), an_deg=get_poly_deg(denom))
-
-    fr_calculations = []
-
-    for i in range(0, depth_diff):
-        if i % reduce_jump == 0:
-            p, q = cf_calc.calc_iter(i)
-        else:
-            p, q = cf_calc.calc_iter(i, False)
-
-        if i % CALC_JUMP == 0 and i != 0:
-            fr_calculations.append(
-                    mpmath.log(mpmath.mpf(math.gcd(p, q))) / mpmath.mpf(i) + data.an_deg * (1 - mpmath.log(i))
-                    )
-    
+    data.convergence_rate = estimate_convergence_rate(num, denom, end_depth)
+    data.stop_reason = StopReason.DEPTH
+    return data
+
+def check_point(cf_calc, data, i, pq_gcd, fr_calculations, samples, target_precision):
+    """
+    Collects the metrics of a calc_jump checkpoint, and returns True if the calculation
+    can stop here. pq_gcd is the gcd of the current p and q, before the reduction.
+    """
+    # p = q = 0 has no gcd to reduce
+    if not pq_gcd:
+        pq_gcd = 1
+    # the gcd of the unreduced p and q, in bits, is the part the reductions already removed plus pq_gcd
+    fr_calculations.append(
+            (cf_calc.reduction + arith_backend.log2(pq_gcd)) / (LOG2_E * i) + data.an_deg * (1 - math.log(i))
+            )
+
+    estimated_precision = cf_calc.estimate_precision()
+    if estimated_precision is not None:
+        # log10 of the denominator of p / q in lowest terms
+        log_q = arith_backend.log10(abs(cf_calc.data.b1)) - arith_backend.log10(pq_gcd)
+        samples.append((i, estimated_precision, log_q))
+        update_metrics(data, samples)
+        stop_reason = get_stop_reason([precision for _, precision, _ in samples], target_precision)
+        if stop_reason:
+            logging.getLogger(LOGGER_NAME).debug(f'Stopping at depth {i} since the cf is {stop_reason}: {cf_calc.num}, {cf_calc.denom}')
+            data.stop_reason = stop_reason
+            return True
+
+    return False
+
+def update_metrics(data, samples):
+    """
+    Updates the metrics of the cf from its (depth, precision, log10 q) checkpoint samples:
+    delta - the irrationality measure, |x - p/q| = 1 / q^(1 + delta)
+    lambda_ - the convergence rate, in digits per step
+    gamma - the growth rate of log10 q per step
+    """
+    depth, precision, log_q = samples[-1]
+    if not math.isfinite(precision):
+        return
+    if log_q > 0:
+        data.delta = precision / log_q - 1
+    if len(samples) > 1 and math.isfinite(samples[-2][1]):
+        last_depth, last_precision, last_log_q = samples[-2]
+        data.lambda_ = (precision - last_precision) / (depth - last_depth)
+        data.gamma = (log_q - last_log_q) / (depth - last_depth)
+
+def process_depth(cf_calc, schedule, data, i, fr_calculations, samples, target_precision):
+    """
+    Handles the state of the cf at a depth yielded by the schedule, the checkpoint
+    metrics and the reduction share a single gcd(p, q). Returns True if the calculation
+    can stop here.
+    """
+    if not schedule.should_reduce(i):
+        return False
+
+    pq_gcd = arith_backend.gcd(cf_calc.data.a1, cf_calc.data.b1)
+    stop = schedule.is_check_point(i) and check_point(cf_calc, data, i, pq_gcd, fr_calculations, samples, target_precision)
+    schedule.update(i, *cf_calc.reduce(pq_gcd))
+    return stop
+
+def is_over_budget(cf_calc, data, i, run_time, time_budget, size_budget):
+    if (time_budget and run_time > time_budget) or (size_budget and cf_calc.get_size() > size_budget):
+        logging.getLogger(LOGGER_NAME).info(f'Stopping at depth {i} after {run_time} seconds, with {cf_calc.get_size()} bits: {cf_calc.num}, {cf_calc.denom}')
+        data.timed_out = True
+        data.stop_reason = StopReason.TIMED_OUT
+        return True
+    return False
+
+def finish_cf(cf_calc, data, fr_calculations, p, q, i):
+    data.calc_depth = i + 1
     can_calc, prec = cf_calc.precision
     if not can_calc:
-        logging.getLogger(LOGGER_NAME).debug(f'Cf does not converge since denom is zero: {num}, {denom}')
+        logging.getLogger(LOGGER_NAME).debug(f'Cf does not converge since denom is zero: {cf_calc.num}, {cf_calc.denom}')
         data.converges = False
         return math.inf, 0, cf_calc.get_calc_data(), asdict(data), i
     
-    value = cf_calc.value
-    precision = 2000 if prec == math.inf else prec
+    precision = MAX_PRECISION if prec == math.inf else prec
+    value = cf_calc.get_value(precision)
     data.fr = check_fr(fr_calculations)
-    if mpmath.almosteq(0, mpmath.mpf(p) / mpmath.mpf(q)):
+    if is_almost_zero(p, q):
         logging.getLogger(LOGGER_NAME).debug('Rounding to 0')
         data.original_value = str(value)
         data.rounded = True
         value = 0
 
-    data.rational = check_rational(p, q)
-    data.reduction = cf_calc.reduction
+    data.rational = check_rational(cf_calc.data.a1, cf_calc.data.b1, precision)
+    data.reduction = round(cf_calc.reduction)
 
     return value, precision, cf_calc.get_calc_data(), asdict(data), i
 
+def calculate_cf(num, denom, depth_diff, previous_calc=None, verbose=False, skip=1, reduce_jump=False, engine=ITERATIVE_ENGINE, calc_jump=False, target_precision=False,
+        start_depth=0, time_budget=False, size_budget=False):
+    """
+    Runs depth_diff steps of the recurrence. To continue an older calculation pass its
+    previous_calc, with the number of steps it already contains as start_depth.
+    A cf that takes more than time_budget seconds, or whose state grows beyond size_budget
+    bits, is stopped with the result so far and marked as timed out.
+    """
+    num = [int(i) for i in num]
+    denom = [int(i) for i in denom]
+    if not reduce_jump:
+        reduce_jump = REDUCE_JUMP
+    if not calc_jump:
+        calc_jump = CALC_JUMP
+    if not target_precision:
+        target_precision = TARGET_PRECISION
+    
+    cf_calc = CfCalc(num, denom, previous_calc, engine)
+    data = init_cf_data(num, denom, start_depth + depth_diff)
+
+    fr_calculations = []
+    samples = []
+
+    start_time = time.time()
+    schedule = ReductionSchedule(start_depth, start_depth + depth_diff, reduce_jump, calc_jump)
+    start = start_depth
+    for i in schedule:
+        p, q = cf_calc.calc_range(start, i + 1, False)
+        start = i + 1
+
+        if process_depth(cf_calc, schedule, data, i, fr_calculations, samples, target_precision):
+            break
+        if i < schedule.end_depth - 1 and is_over_budget(cf_calc, data, i, time.time() - start_time, time_budget, size_budget):
+            break
+
+    return finish_cf(cf_calc, data, fr_calculations, p, q, i)
+
+def log_values(values):
+    return np.array([math.log10(abs(value)) if value else -math.inf for value in values])
+
+def calculate_cf_batch(nums, denoms, depth_diff, previous_calcs=None, reduce_jump=False, calc_jump=False, target_precision=False, start_depth=0,
+        time_budget=False, size_budget=False):
+    """
+    Same as calling calculate_cf on every (num, denom) pair, but the polynomial values
+    of a whole block are evaluated for all of the cfs at once, and the recurrences are
+    stepped together on numpy object arrays. Works best when all of the cfs have the
+    same degrees.
+    """
+    nums = [[int(i) for i in num] for num in nums]
+    denoms = [[int(i) for i in denom] for denom in denoms]
+    if not previous_calcs:
+        previous_calcs = [None] * len(nums)
+    if not reduce_jump:
+        reduce_jump = REDUCE_JUMP
+    if not calc_jump:
+        calc_jump = CALC_JUMP
+    if not target_precision:
+        target_precision = TARGET_PRECISION
+
+    cf_calcs = [CfCalc(num, denom, previous_calc) for num, denom, previous_calc in zip(nums, denoms, previous_calcs)]
+    datas = [init_cf_data(num, denom, start_depth + depth_diff) for num, denom in zip(nums, denoms)]
+    fr_calculations = [[] for _ in nums]
+    samples = [[] for _ in nums]
+    results = [None] * len(nums)
+
+    active = np.arange(len(nums))
+    # the time of every block is shared by the cfs that were still active in it
+    run_times = np.zeros(len(nums))
+    last_time = time.time()
+    schedule = ReductionSchedule(start_depth, start_depth + depth_diff, reduce_jump, calc_jump)
+    start = start_depth
+    for i in schedule:
+        a0, b0, a1, b1 = [np.array([cf_calcs[k].data[j] for k in active], dtype=object) for j in range(4)]
+        log_det = np.array([cf_calcs[k].log_det for k in active])
+        num_values = batch_utils.get_poly_values([nums[k] for k in active], start + 1, i + 2)
+        denom_values = batch_utils.get_poly_values([denoms[k] for k in active], start + 1, i + 2)
+        for j in range(i + 1 - start):
+            a = num_values[:, j]
+            b = denom_values[:, j]
+            log_det += log_values(a)
+            p = b*a1 + a*a0
+            q = b*b1 + a*b0
+            a0, b0, a1, b1 = a1, b1, p, q
+        start = i + 1
+
+        for idx, k in enumerate(active):
+            cf_calcs[k].data = CalcData(a0[idx], b0[idx], a1[idx], b1[idx])
+            cf_calcs[k].log_det = log_det[idx]
+
+        keep = np.ones(len(active), dtype=bool)
+        if schedule.should_reduce(i):
+            # the cfs share the schedule, so it adapts to the bits of all of them together
+            grown_bits, removed_bits = 0, 0
+            for idx, k in enumerate(active):
+                pq_gcd = arith_backend.gcd(p[idx], q[idx])
+                if schedule.is_check_point(i) and check_point(cf_calcs[k], datas[k], i, pq_gcd, fr_calculations[k], samples[k], target_precision):
+                    keep[idx] = False
+                grown, removed = cf_calcs[k].reduce(pq_gcd)
+                grown_bits, removed_bits = grown_bits + grown, removed_bits + removed
+            schedule.update(i, grown_bits, removed_bits)
+
+        now = time.time()
+        run_times[active] += (now - last_time) / len(active)
+        last_time = now
+        if i < schedule.end_depth - 1:
+            for idx, k in enumerate(active):
+                if keep[idx] and is_over_budget(cf_calcs[k], datas[k], i, run_times[k], time_budget, size_budget):
+                    keep[idx] = False
+
+        for idx, k in enumerate(active):
+            if not keep[idx]:
+                results[k] = finish_cf(cf_calcs[k], datas[k], fr_calculations[k], p[idx], q[idx], i)
+        active, p, q = active[keep], p[keep], q[keep]
+        if not len(active):
+            break
+
+    for idx, k in enumerate(active):
+        results[k] = finish_cf(cf_calcs[k], datas[k], fr_calculations[k], p[idx], q[idx], i)
+
+    return results
+
 
 def parse_result_type(cf_id, val, precision):
     if val == math.inf:
@@ -208,37 +670,189 @@ def parse_result_type(cf_id, val, precision):
             return PrecisionType.LOW_PREC
 
 
+def prescreen_cfs(cfs, prec_types):
+    """
+    Runs the float pre-screen on the cfs without old precision data. Returns the cfs
+    that have to be calculated exactly, and the precision data of the rest.
+    """
+    new_cfs = [cf for cf in cfs if not cf.precision_data]
+    if not new_cfs:
+        return cfs, []
+
+    nums = [[int(i) for i in cf.partial_numerator] for cf in new_cfs]
+    denoms = [[int(i) for i in cf.partial_denominator] for cf in new_cfs]
+    outcomes, precisions, values = prescreen_utils.prescreen(nums, denoms, DEPTH, PRECISION_FILTER)
+
+    survivors = [cf for cf in cfs if cf.precision_data]
+    results = []
+    for cf, num, denom, outcome, precision, value in zip(new_cfs, nums, denoms, outcomes, precisions, values):
+        if outcome == prescreen_utils.SURVIVED:
+            survivors.append(cf)
+            continue
+
+        data = CfData(bn_deg=get_poly_deg(num), an_deg=get_poly_deg(denom), stop_reason=outcome, prescreened=True)
+        data.convergence_rate = estimate_convergence_rate(num, denom, DEPTH)
+        if outcome == prescreen_utils.ZERO_DENOMINATOR:
+            data.converges = False
+            precision, value = 0, 0
+            prec_types[PrecisionType.NO_PREC] += 1
+        else:
+            precision = math.floor(precision)
+            value = float(value) if math.isfinite(value) else 0
+            prec_types[PrecisionType.LOW_PREC] += 1
+        logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} was screened out since it is {outcome}')
+        results.append(models.CfPrecision(cf_id=cf.cf_id, depth=prescreen_utils.PRESCREEN_DEPTH, precision=precision,
+            value=value, previous_calc=[], general_data=asdict(data)))
+
+    logging.getLogger(LOGGER_NAME).info(f'Pre-screen left {len(survivors)} out of {len(cfs)} cfs')
+    return survivors, results
+
+def derive_precision(cf):
+    """
+    Derives the precision data of a cf from the one of its canonical form. Returns None
+    if the canonical form has no state to derive from.
+    """
+    canonical = cf.canonical
+    if not canonical or not canonical.precision_data or len(canonical.precision_data.previous_calc) != 4:
+        return None
+
+    canonical_data = canonical.precision_data
+    scale, shift = cf.canonical_transform['scale'], cf.canonical_transform['shift']
+    canonical_general = canonical_data.general_data or {}
+    calc_depth = canonical_general.get('calc_depth', canonical_data.depth + 1) + shift
+    if calc_depth <= 0:
+        return None
+
+    calc_data = canonical_utils.derive_calc([int(i) for i in canonical.partial_numerator], [int(i) for i in canonical.partial_denominator],
+            scale, shift, canonical_data.previous_calc)
+    cf_calc = CfCalc([int(i) for i in cf.partial_numerator], [int(i) for i in cf.partial_denominator], calc_data)
+    can_calc, prec = cf_calc.precision
+    if not can_calc:
+        precision, value = 0, 0
+    else:
+        precision = MAX_PRECISION if prec == math.inf else prec
+        value = cf_calc.get_value(precision)
+    # only the flags that a scale and shift keep, the rest describe the calculation of the canonical form
+    data = CfData(an_deg=canonical_general.get('an_deg', 0), bn_deg=canonical_general.get('bn_deg', 0),
+            rational=canonical_general.get('rational', 0), lambda_=canonical_general.get('lambda_', 0),
+            convergence_rate=canonical_general.get('convergence_rate', 0),
+            converges=can_calc, calc_depth=calc_depth, derived_from=str(canonical.cf_id))
+    logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} was derived from {canonical.cf_id} with scale {scale} and shift {shift}')
+    return models.CfPrecision(cf_id=cf.cf_id, depth=calc_depth - 1, precision=precision, value=value, previous_calc=calc_data, general_data=asdict(data))
+
+def derive_cfs(cfs, prec_types):
+    """
+    Derives the precision data of the cfs that have a calculated canonical form. Returns
+    the cfs that have to be calculated, and the derived precision data.
+    """
+    left_cfs = []
+    results = []
+    for cf in cfs:
+        precision_data = derive_precision(cf) if cf.canonical_id else None
+        if not precision_data:
+            left_cfs.append(cf)
+            continue
+        val = precision_data.value if precision_data.general_data['converges'] else math.inf
+        prec_types[parse_result_type(cf.cf_id, val, precision_data.precision)] += 1
+        results.append(precision_data)
+    return left_cfs, results
+
+def update_precision_data(precision_data, result):
+    """
+    Updates the precision data of a cf in place with the result of a calculation that
+    continued it.
+    """
+    val, precision, calc_data, general_data, real_depth = result
+    precision_data.depth = real_depth
+    precision_data.precision = precision
+    precision_data.value = 0 if val == math.inf else val
+    precision_data.previous_calc = calc_data
+    precision_data.general_data = {**(precision_data.general_data or {}), **general_data}
+    precision_data.update_time = datetime.now()
+
+def get_updated_precision(precision_data, result):
+    """
+    Same as update_precision_data, but returns new precision data instead of updating the
+    one of the cf, which the workers only get as a wire record.
+    """
+    updated = models.CfPrecision(cf_id=precision_data.cf_id, general_data=precision_data.general_data)
+    update_precision_data(updated, result)
+    return updated
+
+def get_previous_calc(cf):
+    """
+    Returns the previous_calc of the cf and the number of steps it contains.
+    """
+    if cf.precision_data and cf.precision_data.previous_calc:
+        logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} has old precision data')
+        general_data = cf.precision_data.general_data or {}
+        return cf.precision_data.previous_calc, general_data.get('calc_depth', cf.precision_data.depth + 1)
+    return None, 0
+
+def calculate_cfs(cfs, calc_config, depth=DEPTH):
+    """
+    Yields every cf with its calculate_cf result, continuing from its old precision data
+    if it has one. The batch engine calculates the cfs with the same degrees together.
+    """
+    calc_config = dict(calc_config)
+    engine = calc_config.pop('engine')
+    if engine != BATCH_ENGINE:
+        for cf in cfs:
+            logging.getLogger(LOGGER_NAME).debug(f'calculating for {cf.cf_id}: {cf.partial_numerator}, {cf.partial_denominator}')
+            previous_calc, start_depth = get_previous_calc(cf)
+            start_time = time.time()
+            result = calculate_cf(cf.partial_numerator, cf.partial_denominator, depth, previous_calc, engine=engine, start_depth=start_depth, **calc_config)
+            logging.getLogger(LOGGER_NAME).debug(f'calculation of {cf.partial_numerator}, {cf.partial_denominator}, took {time.time() - start_time} seconds')
+            yield cf, result
+        return
+
+    shapes = {}
+    for cf in cfs:
+        start_depth = get_previous_calc(cf)[1]
+        shapes.setdefault((len(cf.partial_numerator), len(cf.partial_denominator), start_depth), []).append(cf)
+    for shape, shape_cfs in shapes.items():
+        logging.getLogger(LOGGER_NAME).debug(f'calculating {len(shape_cfs)} cfs of shape {shape} together')
+        start_time = time.time()
+        batch_results = calculate_cf_batch([cf.partial_numerator for cf in shape_cfs], [cf.partial_denominator for cf in shape_cfs], depth,
+                [get_previous_calc(cf)[0] for cf in shape_cfs], start_depth=shape[2], **calc_config)
+        logging.getLogger(LOGGER_NAME).debug(f'calculation of {len(shape_cfs)} cfs of shape {shape}, took {time.time() - start_time} seconds')
+        yield from zip(shape_cfs, batch_results)
+
 def execute_job(cfs):
     logging.config.fileConfig('logging.config', defaults={'log_filename': f'precision_worker_{os.getpid()}'})
-    results = []
+    arith_backend.log_backend(LOGGER_NAME)
+    calc_config = get_calc_config()
     prec_types = { PrecisionType.HIGH_PREC: 0, PrecisionType.LOW_PREC: 0, PrecisionType.NO_PREC: 0 }
+    cfs = [wire_utils.unpack_cf(cf) for cf in cfs]
 
-    for cf in cfs:
-        logging.getLogger(LOGGER_NAME).debug(f'calculating for {cf.cf_id}: {cf.partial_numerator}, {cf.partial_denominator}')
-        previous_calc = None
-        if cf.precision_data:
-            logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} has old precision data')
-            previous_calc = cf.precision_data.previous_calc
-        start_time = time.time()
-        val, precision, calc_data, general_data, real_depth = calculate_cf(cf.partial_numerator, cf.partial_denominator, DEPTH, previous_calc)
-        logging.getLogger(LOGGER_NAME).debug(f'calculation of {cf.partial_numerator}, {cf.partial_denominator}, took {time.time() - start_time} seconds')
+    cfs, results = derive_cfs(cfs, prec_types)
+    if get_job_config().get('prescreen', False):
+        cfs, screened = prescreen_cfs(cfs, prec_types)
+        results += screened
+
+    for cf, (val, precision, calc_data, general_data, real_depth) in calculate_cfs(cfs, calc_config):
         prec_types[parse_result_type(cf.cf_id, val, precision)] += 1
         if val == math.inf:
             val = 0
         results.append(models.CfPrecision(cf_id=cf.cf_id, depth=real_depth, precision=precision, value=val, previous_calc=calc_data, general_data=general_data))
     
-    logging.getLogger(LOGGER_NAME).info('Done calculation')
-    return results, prec_types
+    logging.getLogger(LOGGER_NAME).info(f'Done calculation, polynomial cache hit rate: {SEQUENCE_CACHE.hit_rate:.2f}')
+    return [wire_utils.pack_precision(result) for result in results], prec_types
 
 def run_query(bulk=0, num_denom_factor=None):
     logging.config.fileConfig('logging.config', defaults={'log_filename': f'precision_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
     db_handle = ramanujan_db.RamanujanDB()
 
     if not bulk:
         bulk = BULK_SIZE
     logging.getLogger(LOGGER_NAME).info(f'starting to calculate precision for {bulk} cfs')
 
-    queried_data = db_handle.session.query(models.Cf).filter(*get_filters(num_denom_factor)).limit(bulk).all()
+    queried_data = db_handle.session.query(models.Cf).options(joinedload(models.Cf.canonical)).filter(*DERIVE_FILTERS).limit(bulk).all()
+    logging.getLogger(LOGGER_NAME).info(f'{len(queried_data)} cfs will be derived from their canonical form')
+    if len(queried_data) < bulk:
+        queried_data += db_handle.session.query(models.Cf).filter(*get_filters(num_denom_factor)).limit(bulk - len(queried_data)).all()
+    queried_data = [wire_utils.pack_cf(cf) for cf in queried_data]
     db_handle.session.close()
     logging.getLogger(LOGGER_NAME).info(f'size of batch is {len(queried_data)}')
     return queried_data
@@ -250,7 +864,7 @@ def summarize_results(results):
     
     logging.getLogger(LOGGER_NAME).info(f'Committing work')
     for passed_cfs, prec_types in results:
-        db_handle.session.add_all(passed_cfs)
+        db_handle.session.add_all([wire_utils.unpack_precision(record) for record in passed_cfs])
         try:
             db_handle.session.commit()
             agg_passed += len(passed_cfs)
@@ -277,7 +891,7 @@ def run_one(numerator, denominator, db_handle=None, depth=DEPTH, write_to_db=Fal
 
         if not write_to_db:
             cf_id = 0
-        val, precision, calc_data, general_data, real_depth = calculate_cf(numerator, denominator, depth)
+        val, precision, calc_data, general_data, real_depth = calculate_cf(numerator, denominator, depth, **get_calc_config())
         if val == math.inf:
             val = 0
             print('Val is 0')
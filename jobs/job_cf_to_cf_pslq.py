@@ -1,23 +1,45 @@
+import os
 import time
-import logging 
+import logging
+import logging.config
+import math
+import itertools
+from collections import namedtuple
 import mpmath as mp
 
-from sqlalchemy import or_, Integer, Float
+import config
+
+from sqlalchemy import or_, Integer, Float, DateTime
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import func
 from sqlalchemy.orm.attributes import flag_modified
 
 from db import models
 from db import ramanujan_db
 from jobs import pslq_utils
+from jobs import fingerprint_utils
+from jobs import prescreen_utils
+from jobs import arith_backend
 
 mp.mp.dps = 2000
 
 ALGORITHM_NAME = 'PSLQ_CF_CF'
+JOB_NAME = 'cf_to_cf_pslq'
 LOGGER_NAME = 'job_logger'
 BULK_SIZE = 500
 PRECISION_FACTOR = 9 / 10
 MIN_PRECISION = 100
-      
-logging.config.fileConfig('logging.config', defaults={'log_filename': 'cf_to_cf'})
+# with the fingerprint index, relations (a*x + b) / (c*x + d) with coefficients up to
+# fingerprint_coeff are always found, and only some of the bigger ones that pslq could find
+FINGERPRINT_COEFF = 2
+INDEX_COEFF = 1
+# every tile compares the new cfs (or at least NEW_TILE_SIZE of them) with up to
+# EXISTING_TILE_SIZE other cfs
+NEW_TILE_SIZE = 100
+EXISTING_TILE_SIZE = 5000
+COMMIT_SIZE = 500
+# a cf that was scanned within this time of the insertion of another one, didn't see it
+SCAN_OVERLAP = 30*60
 
 BASE_FILTERS = [
         models.Cf.precision_data,
@@ -30,69 +52,190 @@ FILTERS = BASE_FILTERS + [
         or_(models.Cf.scanned_algo == None, ~models.Cf.scanned_algo.has_key(ALGORITHM_NAME))
         ]
 
-def get_filter_per_cf(cf_id, insertion_time):
-    return BASE_FILTERS + [
-            models.Cf.cf_id != cf_id,
-            or_(models.Cf.scanned_algo == None,
-                ~models.Cf.scanned_algo.has_key(ALGORITHM_NAME),
-                models.Cf.scanned_algo[ALGORITHM_NAME].cast(Integer) < insertion_time.timestamp() + 30*60
-                )
-            ]
-
-def get_cf_connection(cf, cfs):
-    logging.getLogger(LOGGER_NAME).debug(f'checking cf {cf.cf_id} - numerator: {cf.partial_numerator}, denominator: {cf.partial_denominator}')
-    
-    cf_precision = cf.precision_data.precision
-    check_against = 0
-
-    for second in cfs.filter(*get_filter_per_cf(cf.cf_id, cf.precision_data.insertion_date)).all():
-        logging.getLogger(LOGGER_NAME).debug(f'Starting to check with cf_id {second.cf_id}')
-
-        prec = int(min(second.precision_data.precision, cf_precision) * PRECISION_FACTOR)
-        if prec < MIN_PRECISION * PRECISION_FACTOR:
-            logging.getLogger(LOGGER_NAME).error(f'Minimum precision is too low: {prec}. main cf precision: {cf_precision}, checked against cf precision: {second.precision_data.precision}')
-            continue
-
-        check_against += 1
-        
-        mp.mp.dps = prec
-        first_value = mp.mpf(str(cf.precision_data.previous_calc[2])) / mp.mpf(str(cf.precision_data.previous_calc[3]))
-        second_value = mp.mpf(str(second.precision_data.previous_calc[2])) / mp.mpf(str(second.precision_data.previous_calc[3]))
-
-        result = None
-        try:
-            result = pslq_utils.check_int_null_vector(first_value, second_value)
-        except Exception as e:
-            logging.getLogger(LOGGER_NAME).error(f'Exception occurred in pslq. {cf.cf_id} - {second.cf_id}. values: {first_value} - {second_value}', exc_info=True)
-
-        if result:
-            logging.getLogger(LOGGER_NAME).info(f'Found connection {cf.cf_id} - {second.cf_id}: {result}')
-            yield models.ContinuedFractionRelation(source_cf=cf.cf_id, target_cf=second.cf_id, connection_type="PSLQ", connection_details=result)
-
-    logging.getLogger(LOGGER_NAME).debug(f'compared {cf.cf_id} to {check_against} other cfs')
+# what a tile needs to know about a cf, instead of the whole orm object
+CfRecord = namedtuple('CfRecord', ['cf_id', 'precision', 'p', 'q', 'insertion_time', 'scanned_time'])
+
+# the columns of a record, previous_calc is indexed from 1 in sql. The insertion date is
+# turned into an epoch by the db, in the time zone it was written in.
+RECORD_COLUMNS = [
+        models.Cf.cf_id,
+        models.CfPrecision.precision,
+        models.CfPrecision.previous_calc[3].label('p'),
+        models.CfPrecision.previous_calc[4].label('q'),
+        func.extract('epoch', models.CfPrecision.insertion_date.cast(DateTime(timezone=True))).label('insertion_time'),
+        models.Cf.scanned_algo
+        ]
 
-def run_job(bulk=0):
+def get_record(row):
+    scanned_time = row.scanned_algo.get(ALGORITHM_NAME) if row.scanned_algo else None
+    return CfRecord(row.cf_id, row.precision, row.p, row.q, float(row.insertion_time), scanned_time)
+
+def query_records(db_handle, filters):
+    return db_handle.session.query(*RECORD_COLUMNS).select_from(models.Cf).join(models.CfPrecision, models.CfPrecision.cf_id == models.Cf.cf_id).filter(*filters)
+
+# the new cfs of a tile are compared with its existing cfs, new_ids are the ids of all of the
+# new cfs in the bulk
+Tile = namedtuple('Tile', ['new_cfs', 'existing_cfs', 'new_ids'])
+
+def should_compare(cf, second, new_ids):
+    """
+    The pairs that get_filter_per_cf used to leave: a cf isn't compared to itself, two new
+    cfs are compared once, and an old cf only if it was scanned before it could see cf.
+    """
+    if second.cf_id == cf.cf_id:
+        return False
+    if second.cf_id in new_ids:
+        return cf.cf_id < second.cf_id
+    return second.scanned_time is None or second.scanned_time < cf.insertion_time + SCAN_OVERLAP
+
+def get_job_config():
+    return config.configuration['jobs_to_run'].get(JOB_NAME, {})
+
+def check_pair(cf, second, tiered=True):
+    logging.getLogger(LOGGER_NAME).debug(f'Starting to check {cf.cf_id} with cf_id {second.cf_id}')
+
+    prec = int(min(second.precision, cf.precision) * PRECISION_FACTOR)
+    if prec < MIN_PRECISION * PRECISION_FACTOR:
+        logging.getLogger(LOGGER_NAME).error(f'Minimum precision is too low: {prec}. main cf precision: {cf.precision}, checked against cf precision: {second.precision}')
+        return None
+
+    mp.mp.dps = prec
+    first_value = mp.mpf(cf.p) / mp.mpf(cf.q)
+    second_value = mp.mpf(second.p) / mp.mpf(second.q)
+
+    result = None
+    try:
+        if tiered:
+            result = pslq_utils.check_int_null_vector_tiered(first_value, second_value)
+        else:
+            result = pslq_utils.check_int_null_vector(first_value, second_value)
+    except Exception as e:
+        logging.getLogger(LOGGER_NAME).error(f'Exception occurred in pslq. {cf.cf_id} - {second.cf_id}. values: {first_value} - {second_value}', exc_info=True)
+
+    if result:
+        logging.getLogger(LOGGER_NAME).info(f'Found connection {cf.cf_id} - {second.cf_id}: {result}')
+        return cf.cf_id, second.cf_id, result
+
+    return None
+
+def screen_pairs(pairs, max_coeff):
+    """
+    Leaves the pairs that might have a relation with coefficients up to max_coeff, 0 leaves
+    all of them.
+    """
+    if not max_coeff or not pairs:
+        return pairs
+    first_values = [float(fingerprint_utils.get_value(cf.p, cf.q)) for cf, _ in pairs]
+    second_values = [float(fingerprint_utils.get_value(second.p, second.q)) for _, second in pairs]
+    passed = prescreen_utils.screen_relations(first_values, second_values, max_coeff)
+    logging.getLogger(LOGGER_NAME).debug(f'{passed.sum()} out of {len(pairs)} pairs passed the relation screen')
+    return [pair for pair, pair_passed in zip(pairs, passed) if pair_passed]
+
+def get_pairs(new_cfs, existing_cfs, new_ids, job_config):
+    if not job_config.get('fingerprint_index', False):
+        return [(cf, second) for cf in new_cfs for second in existing_cfs if should_compare(cf, second, new_ids)]
+
+    # only the pairs whose fingerprints match go on to pslq
+    index = fingerprint_utils.FingerprintIndex(job_config.get('index_coeff', INDEX_COEFF))
+    for second in existing_cfs:
+        index.add(second.cf_id, fingerprint_utils.get_value(second.p, second.q))
+    transforms = fingerprint_utils.get_transforms(job_config.get('fingerprint_coeff', FINGERPRINT_COEFF))
+    existing_by_id = {second.cf_id: second for second in existing_cfs}
+    pairs = []
+    for cf in new_cfs:
+        for cf_id in index.find(fingerprint_utils.get_value(cf.p, cf.q), transforms):
+            if should_compare(cf, existing_by_id[cf_id], new_ids):
+                pairs.append((cf, existing_by_id[cf_id]))
+    return pairs
+
+def check_tile(tile, job_config):
+    pairs = screen_pairs(get_pairs(tile.new_cfs, tile.existing_cfs, tile.new_ids, job_config), job_config.get('relation_screen_coeff', 0))
+    connections = []
+    for cf, second in pairs:
+        connection = check_pair(cf, second, job_config.get('tiered_pslq', True))
+        if connection:
+            connections.append(connection)
+
+    logging.getLogger(LOGGER_NAME).info(f'compared {len(tile.new_cfs)} cfs to {len(tile.existing_cfs)} cfs in {len(pairs)} pairs - found {len(connections)} results')
+    return connections
+
+def execute_job(tiles):
+    """
+    Compares the cfs of a tile, or of a list of tiles when the pool splits them into chunks.
+    Returns the ids of the new cfs of the tiles and the connections that were found, as
+    (source_cf, target_cf, connection_details).
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'cf_to_cf_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
+    if isinstance(tiles, Tile):
+        tiles = [tiles]
+    job_config = get_job_config()
+    cf_ids = set()
+    connections = []
+    for tile in tiles:
+        cf_ids.update([cf.cf_id for cf in tile.new_cfs])
+        connections += check_tile(tile, job_config)
+
+    pslq_utils.log_tier_stats(LOGGER_NAME)
+    return sorted(cf_ids), connections
+
+def run_query(bulk=0):
+    logging.config.fileConfig('logging.config', defaults={'log_filename': 'cf_to_cf_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
     if not bulk:
         bulk = BULK_SIZE
-    db_handle = ramanujan_db.RamanujanDB()
     logging.getLogger(LOGGER_NAME).info(f'Starting to check connections, bulk size: {bulk}')
-    
-    cfs = 0
-    connections = 0
-    for cf in db_handle.cfs.filter(*FILTERS).limit(bulk):
-        if not cf.scanned_algo:
-            cf.scanned_algo = dict()
-        cf.scanned_algo[ALGORITHM_NAME] = int(time.time())
-        for connection_data in get_cf_connection(cf, db_handle.cfs):
-            db_handle.session.add(connection_data)
+    db_handle = ramanujan_db.RamanujanDB()
+    new_cfs = [get_record(row) for row in query_records(db_handle, FILTERS).limit(bulk)]
+    existing_cfs = [get_record(row) for row in query_records(db_handle, BASE_FILTERS)] if new_cfs else []
+    db_handle.session.close()
+
+    existing_tiles = [existing_cfs[i:i + EXISTING_TILE_SIZE] for i in range(0, len(existing_cfs), EXISTING_TILE_SIZE)]
+    # every existing cf goes to a single tile, unless there are too few tiles to keep the workers busy
+    cores = get_job_config().get('async_cores', 0) or os.cpu_count()
+    new_splits = max(1, min(math.ceil(len(new_cfs) / NEW_TILE_SIZE), math.ceil(cores / max(len(existing_tiles), 1))))
+    new_tile_size = max(math.ceil(len(new_cfs) / new_splits), 1)
+    new_tiles = [new_cfs[i:i + new_tile_size] for i in range(0, len(new_cfs), new_tile_size)]
+    new_ids = frozenset([cf.cf_id for cf in new_cfs])
+    tiles = [Tile(new_tile, existing_tile, new_ids) for new_tile, existing_tile in itertools.product(new_tiles, existing_tiles)]
+    logging.getLogger(LOGGER_NAME).info(f'comparing {len(new_cfs)} new cfs to {len(existing_cfs)} cfs in {len(tiles)} tiles')
+    return tiles
+
+def summarize_results(results):
+    db_handle = ramanujan_db.RamanujanDB()
+    cf_ids = set()
+    connections = {}
+    for tile_cf_ids, tile_connections in results:
+        cf_ids.update(tile_cf_ids)
+        for source_cf, target_cf, connection_details in tile_connections:
+            connections.setdefault(source_cf, {})[target_cf] = connection_details
+
+    # the connections of every batch of cfs are committed together with their scanned marks,
+    # so the cfs of a batch that failed are scanned again
+    logging.getLogger(LOGGER_NAME).info(f'Committing work')
+    scan_time = int(time.time())
+    cf_ids = sorted(cf_ids)
+    committed_cfs = 0
+    committed_connections = 0
+    for i in range(0, len(cf_ids), COMMIT_SIZE):
+        batch = cf_ids[i:i + COMMIT_SIZE]
+        rows = [dict(source_cf=source_cf, target_cf=target_cf, connection_type="PSLQ", connection_details=list(details))
+                for source_cf in batch for target_cf, details in connections.get(source_cf, {}).items()]
+        try:
+            if rows:
+                db_handle.session.execute(postgresql.insert(models.ContinuedFractionRelation).values(rows).on_conflict_do_nothing())
+            for cf in db_handle.cfs.filter(models.Cf.cf_id.in_(batch)):
+                if not cf.scanned_algo:
+                    cf.scanned_algo = dict()
+                cf.scanned_algo[ALGORITHM_NAME] = scan_time
+                # for postgres < 9.4
+                flag_modified(cf, 'scanned_algo')
             db_handle.session.commit()
-            connections += 1
-
-        # for postgres < 9.4
-        flag_modified(cf, 'scanned_algo')
-        db_handle.session.add(cf)
-        db_handle.session.commit()
-        cfs += 1
-
-
-    logging.getLogger(LOGGER_NAME).info(f'finished - worked on {cfs} cfs - found {connections} results')
+            committed_cfs += len(batch)
+            committed_connections += len(rows)
+        except Exception as ex:
+            logging.getLogger(LOGGER_NAME).info(f'There was an error while committing {ex}')
+            db_handle.session.rollback()
+
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'finished - worked on {committed_cfs} out of {len(cf_ids)} cfs - found {committed_connections} results')
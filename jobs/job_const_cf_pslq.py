@@ -1,20 +1,31 @@
+import config
 from db import models
 from db import ramanujan_db
 import mpmath as mp
+import numpy as np
 import time
-from sqlalchemy import Integer, or_, Float
+from sqlalchemy import Integer, or_, Float, String, DateTime
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.sql.expression import func
 from jobs import pslq_utils
+from jobs import prescreen_utils
+from jobs import arith_backend
+from jobs import wire_utils
 import logging
 import logging.config
 import sys
 import os
+from collections import namedtuple
 
 mp.mp.dps = 2000
 
 ALGORITHM_NAME = 'PSLQ_CF_CONST'
 LOGGER_NAME = 'job_logger'
+JOB_NAME = 'const_cf_pslq'
+# the biggest constant_id when the cf was scanned, it has been checked against every constant up to it
+VERSION_KEY = 'PSLQ_CF_CONST_VERSION'
+SCREEN_DPS = 20
 BULK_SIZE = 500
 
 FILTERS = [
@@ -47,25 +58,128 @@ def get_filters(num_denom_factor):
 
     return filters 
 
-def check_cf_to_const(cf_value, const_value):
+def get_epoch(column):
+    """
+    The epoch of a DateTime column. The db fills the dates in its own time zone, so it turns
+    them into epochs as well, to be compared with the scan times of the jobs.
+    """
+    return func.extract('epoch', column.cast(DateTime(timezone=True)))
+
+CachedConstant = namedtuple('CachedConstant', ['constant_id', 'name', 'precision', 'value', 'insertion_time'])
+
+class ConstantCache(object):
+    """
+    The constants of the db, loaded once per worker process. The mpf value of every constant
+    is kept at the biggest working precision it was asked for, and everything is reloaded
+    when the constants in the db change, including a value or precision changed in place.
+    """
+    def __init__(self):
+        self.version = None
+        self.constants = []
+        self.values = {}
+
+    def refresh(self, db_handle):
+        content = func.concat(models.Constant.constant_id, ':', models.Constant.precision, ':', models.Constant.value.cast(String))
+        version = db_handle.session.query(func.count(models.Constant.constant_id), func.max(models.Constant.constant_id),
+                func.md5(func.string_agg(content, aggregate_order_by(',', models.Constant.constant_id)))).one()
+        if tuple(version) == self.version:
+            return
+        logging.getLogger(LOGGER_NAME).info(f'loading constants, version {tuple(version)}')
+        self.version = tuple(version)
+        constants = db_handle.session.query(models.Constant.constant_id, models.Constant.name, models.Constant.precision,
+                models.Constant.value, get_epoch(models.Constant.insertion_date))
+        self.constants = [CachedConstant(constant_id, name, precision, str(value), float(insertion_time or 0))
+                for constant_id, name, precision, value, insertion_time in constants]
+        self.values = {}
+
+    def max_constant_id(self):
+        return self.version[1] if self.version else None
+
+    def get_value(self, const, dps):
+        cached = self.values.get(const.constant_id)
+        if cached is None or cached[0] < dps:
+            with mp.workdps(dps):
+                cached = (dps, mp.mpf(const.value))
+            self.values[const.constant_id] = cached
+        with mp.workdps(dps):
+            return +cached[1]
+
+CONSTANT_CACHE = ConstantCache()
+
+def get_job_config():
+    return config.configuration['jobs_to_run'].get(JOB_NAME, {})
+
+def get_unchecked_constants(cf, constants):
+    """
+    The constants that the cf wasn't checked against yet. The cfs that were scanned before
+    the version was kept saw the constants that were inserted before their scan.
+    """
+    scanned_algo = cf.scanned_algo or {}
+    if ALGORITHM_NAME not in scanned_algo:
+        return constants
+    if VERSION_KEY in scanned_algo:
+        return [const for const in constants if const.constant_id > int(scanned_algo[VERSION_KEY])]
+    return [const for const in constants if const.insertion_time > int(scanned_algo[ALGORITHM_NAME])]
+
+def mark_scanned(cf, constant_cache):
+    if not cf.scanned_algo:
+        cf.scanned_algo = dict()
+    cf.scanned_algo[ALGORITHM_NAME] = int(time.time())
+    cf.scanned_algo[VERSION_KEY] = constant_cache.max_constant_id() or 0
+    # for postgres < 9.4
+    flag_modified(cf, 'scanned_algo')
+
+def get_cf_value(cf, dps):
+    with mp.workdps(dps):
+        return mp.mpf(str(cf.precision_data.previous_calc[2])) / mp.mpf(str(cf.precision_data.previous_calc[3]))
+
+def check_cf_to_const(cf_value, const_value, tiered=True):
     if const_value == 1:
         return None
 
-    result = pslq_utils.check_int_null_vector(mp.mpf(str(const_value)), cf_value)
+    if tiered:
+        result = pslq_utils.check_int_null_vector_tiered(const_value, cf_value)
+    else:
+        result = pslq_utils.check_int_null_vector(const_value, cf_value)
     if result:
         logging.getLogger(LOGGER_NAME).info('Found connection')
 
     return result
 
-def check_cf(cf, constants):
+def screen_constants(cfs, constant_cache, max_coeff, constants=None):
+    """
+    Screens all of the (cf, constant) pairs at once in float64, and returns the constants
+    that might have a relation to every cf. constants maps the cf_ids to the constants to
+    screen them against, all of the constants by default.
+    """
+    if constants is None:
+        constants = {cf.cf_id: constant_cache.constants for cf in cfs}
+    pairs = [(cf, const) for cf in cfs for const in constants[cf.cf_id]]
+    candidates = {cf.cf_id: [] for cf in cfs}
+    if not pairs:
+        return candidates
+    const_values = {const.constant_id: float(constant_cache.get_value(const, SCREEN_DPS)) for _, const in pairs}
+    cf_values = {cf.cf_id: float(get_cf_value(cf, SCREEN_DPS)) for cf in cfs}
+    passed = prescreen_utils.screen_relations(np.array([const_values[const.constant_id] for _, const in pairs]),
+            np.array([cf_values[cf.cf_id] for cf, _ in pairs]), max_coeff)
+    logging.getLogger(LOGGER_NAME).info(f'{passed.sum()} out of {passed.size} pairs passed the relation screen')
+    for (cf, const), pair_passed in zip(pairs, passed):
+        if pair_passed:
+            candidates[cf.cf_id].append(const)
+    return candidates
+
+def check_cf(cf, constant_cache, tiered=True, constants=None):
     logging.getLogger(LOGGER_NAME).info(f'checking cf: {cf.cf_id}: {cf.partial_numerator}, {cf.partial_denominator}')
     connection_data = None
     cf_precision = cf.precision_data.precision
+    # built once at the highest precision needed, pslq rounds it to the working precision
+    cf_value = get_cf_value(cf, cf_precision * 9 // 10)
+    if constants is None:
+        constants = constant_cache.constants
     for const in constants:
         logging.getLogger(LOGGER_NAME).debug(f'checking const {const.name} with cf {cf.cf_id}')
         mp.mp.dps = min(const.precision, cf_precision) * 9 // 10
-        cf_value = mp.mpf(str(cf.precision_data.previous_calc[2])) / mp.mpf(str(cf.precision_data.previous_calc[3]))
-        result = check_cf_to_const(cf_value, const.value)
+        result = check_cf_to_const(cf_value, constant_cache.get_value(const, mp.mp.dps), tiered)
         if result:
             if connection_data:
                 # TODO: Report because we found 2 different constants
@@ -76,21 +190,24 @@ def check_cf(cf, constants):
 
 def execute_job(query_data):
     logging.config.fileConfig('logging.config', defaults={'log_filename': f'pslq_const_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
     db_handle = ramanujan_db.RamanujanDB()
     connections = []
-    cfs = []
+    query_data = [wire_utils.unpack_cf(cf) for cf in query_data]
+    job_config = get_job_config()
+    tiered = job_config.get('tiered_pslq', True)
+    screen_coeff = job_config.get('relation_screen_coeff', 0)
+    CONSTANT_CACHE.refresh(db_handle)
+    candidates = screen_constants(query_data, CONSTANT_CACHE, screen_coeff) if screen_coeff else {}
     for cf in query_data:
-        connection_data = check_cf(cf, db_handle.constants)
+        connection_data = check_cf(cf, CONSTANT_CACHE, tiered, candidates.get(cf.cf_id))
         if connection_data:
             connections.append(connection_data)
-        if not cf.scanned_algo:
-            cf.scanned_algo = dict()
-        cf.scanned_algo[ALGORITHM_NAME] = int(time.time())
-        # for postgres < 9.4
-        flag_modified(cf, 'scanned_algo')
-        cfs.append(cf)
-    logging.getLogger(LOGGER_NAME).info(f'finished - worked on {len(cfs)} cfs - found {len(connections)} results')
-    db_handle.session.add_all(cfs)
+    logging.getLogger(LOGGER_NAME).info(f'finished - worked on {len(query_data)} cfs - found {len(connections)} results')
+    pslq_utils.log_tier_stats(LOGGER_NAME)
+    cfs = db_handle.cfs.filter(models.Cf.cf_id.in_([cf.cf_id for cf in query_data])).all()
+    for cf in cfs:
+        mark_scanned(cf, CONSTANT_CACHE)
     db_handle.session.add_all(connections)
     db_handle.session.commit()
     db_handle.session.close()
@@ -101,11 +218,13 @@ def execute_job(query_data):
 
 def run_query(bulk=0, num_denom_factor=None):
     logging.config.fileConfig('logging.config', defaults={'log_filename': f'pslq_const_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
     if not bulk:
         bulk = BULK_SIZE
     logging.getLogger(LOGGER_NAME).debug(f'Starting to check connections, bulk size: {bulk}')
     db_handle = ramanujan_db.RamanujanDB()
     results = db_handle.session.query(models.Cf).filter(*get_filters(num_denom_factor)).limit(bulk).all()
+    results = [wire_utils.pack_cf(cf, False) for cf in results]
     db_handle.session.close()
     logging.getLogger(LOGGER_NAME).info(f'size of batch is {len(results)}')
     return results
@@ -121,13 +240,10 @@ def summarize_results(results):
 def run_one(cf_id, db_handle,write_to_db=False):
     #db_handle = ramanujan_db.RamanujanDB()
     cf = db_handle.session.query(models.Cf).filter(models.Cf.cf_id == cf_id).first()
-    connection_data = check_cf(cf, db_handle.constants)
+    CONSTANT_CACHE.refresh(db_handle)
+    connection_data = check_cf(cf, CONSTANT_CACHE)
     if write_to_db:
-        if not cf.scanned_algo:
-            cf.scanned_algo = dict()
-        cf.scanned_algo[ALGORITHM_NAME] = int(time.time())
-        # for postgres < 9.4
-        flag_modified(cf, 'scanned_algo')
+        mark_scanned(cf, CONSTANT_CACHE)
 
         db_handle.session.add_all([cf])
         if connection_data:
@@ -0,0 +1,91 @@
+import os
+import logging
+import logging.config
+
+from sqlalchemy import or_, and_, Integer
+from sqlalchemy.sql.expression import func
+
+from db import models
+from db import ramanujan_db
+from jobs import job_const_cf_pslq
+from jobs import pslq_utils
+from jobs import arith_backend
+from jobs import wire_utils
+from jobs.job_const_cf_pslq import ALGORITHM_NAME, VERSION_KEY, CONSTANT_CACHE
+
+LOGGER_NAME = 'job_logger'
+BULK_SIZE = 2000
+
+def get_filters(max_constant_id, last_insertion):
+    """
+    The cfs that const_cf_pslq already scanned, before some of the constants were added.
+    """
+    scanned_algo = models.Cf.scanned_algo
+    # the filters of const_cf_pslq without its last one, that takes the cfs it didn't scan
+    return job_const_cf_pslq.FILTERS[:-1] + [
+            scanned_algo.has_key(ALGORITHM_NAME),
+            or_(scanned_algo[VERSION_KEY].cast(Integer) < max_constant_id,
+                and_(~scanned_algo.has_key(VERSION_KEY), scanned_algo[ALGORITHM_NAME].cast(Integer) < last_insertion))
+            ]
+
+def execute_job(query_data):
+    """
+    Checks every cf only against the constants that were added after it was scanned.
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'pslq_delta_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
+    db_handle = ramanujan_db.RamanujanDB()
+    job_config = job_const_cf_pslq.get_job_config()
+    tiered = job_config.get('tiered_pslq', True)
+    screen_coeff = job_config.get('relation_screen_coeff', 0)
+    CONSTANT_CACHE.refresh(db_handle)
+    query_data = [wire_utils.unpack_cf(cf) for cf in query_data]
+
+    unchecked = {cf.cf_id: job_const_cf_pslq.get_unchecked_constants(cf, CONSTANT_CACHE.constants) for cf in query_data}
+    if screen_coeff:
+        unchecked = job_const_cf_pslq.screen_constants(query_data, CONSTANT_CACHE, screen_coeff, unchecked)
+    connections = []
+    checked = 0
+    for cf in query_data:
+        constants = unchecked[cf.cf_id]
+        checked += len(constants)
+        connection_data = job_const_cf_pslq.check_cf(cf, CONSTANT_CACHE, tiered, constants) if constants else None
+        if connection_data:
+            connections.append(connection_data)
+
+    logging.getLogger(LOGGER_NAME).info(f'finished - checked {len(query_data)} cfs against {checked} new constants - found {len(connections)} results')
+    pslq_utils.log_tier_stats(LOGGER_NAME)
+    for cf in db_handle.cfs.filter(models.Cf.cf_id.in_([cf.cf_id for cf in query_data])):
+        job_const_cf_pslq.mark_scanned(cf, CONSTANT_CACHE)
+    db_handle.session.add_all(connections)
+    db_handle.session.commit()
+    db_handle.session.close()
+
+    return len(query_data), len(connections)
+
+def run_query(bulk=0):
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'pslq_delta_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
+    if not bulk:
+        bulk = BULK_SIZE
+    db_handle = ramanujan_db.RamanujanDB()
+    max_constant_id, last_insertion = db_handle.session.query(func.max(models.Constant.constant_id),
+            func.max(job_const_cf_pslq.get_epoch(models.Constant.insertion_date))).one()
+    if max_constant_id is None:
+        db_handle.session.close()
+        return []
+
+    last_insertion = float(last_insertion or 0)
+    results = db_handle.session.query(models.Cf).filter(*get_filters(max_constant_id, last_insertion)).limit(bulk).all()
+    results = [wire_utils.pack_cf(cf, False) for cf in results]
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'size of delta batch is {len(results)}, constants up to {max_constant_id}')
+    return results
+
+def summarize_results(results):
+    total_cfs = 0
+    total_connections = 0
+    for cfs, connections in results:
+        total_cfs += cfs
+        total_connections += connections
+    logging.getLogger(LOGGER_NAME).info(f'Total delta iteration over: {total_cfs} cfs, found {total_connections} connections')
@@ -0,0 +1,116 @@
+import os
+import logging
+import logging.config
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from db import ramanujan_db
+from db import models
+from jobs import job_calculate_precision
+from jobs import arith_backend
+from jobs import wire_utils
+from jobs.matrix_utils import product_tree
+
+LOGGER_NAME = 'job_logger'
+JOB_NAME = 'deep_precision'
+BULK_SIZE = 1
+DEEP_DEPTH = 100000
+# the segments have no checkpoints, so only these fields of general_data follow from the
+# combined state, and the metrics of the last full calculation stay
+COMBINED_KEYS = ['stop_reason', 'calc_depth', 'rational', 'converges', 'reduction']
+
+# the candidates of an identity, that have to be confirmed at a big depth
+FILTERS = [
+        models.Cf.precision_data != None,
+        models.Cf.precision_data.has(models.CfPrecision.depth < DEEP_DEPTH - 1),
+        models.Cf.cf_id.in_(select(models.CfConstantConnection.cf_id))
+        ]
+
+Segment = namedtuple('Segment', ['cf_id', 'num', 'denom', 'start', 'end'])
+
+def get_segments(cf, segments):
+    """
+    Splits the depths between the stored state of the cf and DEEP_DEPTH into segments
+    of about the same size.
+    """
+    start_depth = job_calculate_precision.get_previous_calc(cf)[1]
+    num = [int(i) for i in cf.partial_numerator]
+    denom = [int(i) for i in cf.partial_denominator]
+    bounds = [start_depth + (DEEP_DEPTH - start_depth) * k // segments for k in range(segments + 1)]
+    return [Segment(cf.cf_id, num, denom, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+def combine_segments(cf, results):
+    """
+    Multiplies the stored state of the cf by the matrices of its segments. Returns the
+    calculate_cf result of the whole range, or None if the segments don't cover it.
+    """
+    previous_calc, start_depth = job_calculate_precision.get_previous_calc(cf)
+    results = sorted(results, key=lambda result: result[0])
+    if not results or results[0][0] != start_depth or any([results[k][1] != results[k+1][0] for k in range(len(results) - 1)]):
+        logging.getLogger(LOGGER_NAME).error(f'The segments of cf {cf.cf_id} do not cover the depths from its stored depth {start_depth}')
+        return None
+
+    num = [int(i) for i in cf.partial_numerator]
+    denom = [int(i) for i in cf.partial_denominator]
+    cf_calc = job_calculate_precision.CfCalc(num, denom, previous_calc)
+    matrix = product_tree([matrix for _, _, matrix, _ in results])
+    p, q = cf_calc.apply_matrix(matrix, sum([log_det for _, _, _, log_det in results]))
+    cf_calc.reduce()
+    data = job_calculate_precision.init_cf_data(num, denom, results[-1][1])
+    return job_calculate_precision.finish_cf(cf_calc, data, [], p, q, results[-1][1] - 1)
+
+def execute_job(segments):
+    """
+    Calculates the matrix products of the segments, the segments of a single cf are
+    spread between the workers.
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'deep_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
+    results = []
+    for segment in segments:
+        logging.getLogger(LOGGER_NAME).debug(f'calculating depths {segment.start} - {segment.end} of cf {segment.cf_id}')
+        cf_calc = job_calculate_precision.CfCalc(segment.num, segment.denom, None)
+        matrix, log_det = cf_calc.get_segment_matrix(segment.start, segment.end)
+        results.append((segment.cf_id, segment.start, segment.end, [wire_utils.pack_int(x) for x in matrix], log_det))
+    return results
+
+def run_query(bulk=0, segments=0):
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'deep_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
+    db_handle = ramanujan_db.RamanujanDB()
+
+    if not bulk:
+        bulk = BULK_SIZE
+    if not segments:
+        segments = os.cpu_count()
+
+    cfs = db_handle.session.query(models.Cf).filter(*FILTERS).limit(bulk).all()
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'calculating {len(cfs)} cfs to depth {DEEP_DEPTH} in {segments} segments each')
+    return [segment for cf in cfs for segment in get_segments(cf, segments)]
+
+def summarize_results(results):
+    db_handle = ramanujan_db.RamanujanDB()
+    cf_results = {}
+    for chunk in results:
+        for cf_id, start, end, matrix, log_det in chunk:
+            cf_results.setdefault(cf_id, []).append((start, end, tuple([wire_utils.unpack_int(x) for x in matrix]), log_det))
+
+    for cf_id, segment_results in cf_results.items():
+        cf = db_handle.session.query(models.Cf).filter(models.Cf.cf_id == cf_id).one()
+        result = combine_segments(cf, segment_results)
+        if not result:
+            continue
+
+        result = result[:3] + ({key: result[3][key] for key in COMBINED_KEYS},) + result[4:]
+        logging.getLogger(LOGGER_NAME).info(f'cf {cf_id} has precision {result[1]} at depth {result[4]}, was {cf.precision_data.precision}')
+        job_calculate_precision.update_precision_data(cf.precision_data, result)
+        try:
+            db_handle.session.commit()
+        except Exception as ex:
+            logging.getLogger(LOGGER_NAME).info(f'There was an error while committing {ex}')
+            db_handle.session.rollback()
+
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'Deep calculation done for {len(cf_results)} cfs')
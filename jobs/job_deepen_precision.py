@@ -0,0 +1,101 @@
+import logging
+import logging.config
+import os
+
+from datetime import datetime
+
+from sqlalchemy import Float, or_
+from sqlalchemy.sql.expression import func
+
+from db import ramanujan_db
+from db import models
+from jobs import job_calculate_precision
+from jobs import arith_backend
+from jobs import wire_utils
+from jobs.job_calculate_precision import StopReason
+
+LOGGER_NAME = 'job_logger'
+JOB_NAME = 'deepen_precision'
+BULK_SIZE = 1000
+DEPTH_WINDOW = 1200
+MAX_DEPTH = 20000
+MIN_PRECISION = 10
+PSLQ_PRECISION = 100
+
+# cfs that got somewhere at shallow depth, and that at their current rate of convergence
+# will pass the pslq threshold before MAX_DEPTH
+FILTERS = [
+        models.Cf.precision_data != None,
+        models.Cf.precision_data.has(models.CfPrecision.precision >= MIN_PRECISION),
+        models.Cf.precision_data.has(models.CfPrecision.precision <= PSLQ_PRECISION),
+        models.Cf.precision_data.has(models.CfPrecision.depth < MAX_DEPTH),
+        models.Cf.precision_data.has(func.cardinality(models.CfPrecision.previous_calc) == 4),
+        models.Cf.precision_data.has(models.CfPrecision.precision * MAX_DEPTH >= PSLQ_PRECISION * (models.CfPrecision.depth + 1)),
+        models.Cf.precision_data.has(models.CfPrecision.general_data['rational'].cast(Float) == 0.0),
+        models.Cf.precision_data.has(or_(~models.CfPrecision.general_data.has_key('stop_reason'),
+            models.CfPrecision.general_data['stop_reason'].astext.notin_([StopReason.DIVERGING, StopReason.STAGNANT])))
+        ]
+
+def execute_job(cfs):
+    """
+    Continues the recurrence of every cf from its stored state for another DEPTH_WINDOW
+    steps, and updates its precision data in place.
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'deepen_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
+    calc_config = job_calculate_precision.get_calc_config(JOB_NAME)
+    cfs = [wire_utils.unpack_cf(cf) for cf in cfs]
+    results = []
+    passed_pslq = 0
+
+    for cf, result in job_calculate_precision.calculate_cfs(cfs, calc_config, DEPTH_WINDOW):
+        precision_data = cf.precision_data
+        precision, real_depth = result[1], result[4]
+        logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} went from precision {precision_data.precision} at depth {precision_data.depth} '
+                f'to {precision} at depth {real_depth}')
+        if precision_data.precision <= PSLQ_PRECISION < precision:
+            passed_pslq += 1
+        results.append(wire_utils.pack_precision(job_calculate_precision.get_updated_precision(precision_data, result)))
+
+    logging.getLogger(LOGGER_NAME).info(f'Done deepening, {passed_pslq} out of {len(results)} cfs passed the pslq precision')
+    return results, passed_pslq
+
+def run_query(bulk=0):
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'deepen_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
+    db_handle = ramanujan_db.RamanujanDB()
+
+    if not bulk:
+        bulk = BULK_SIZE
+    logging.getLogger(LOGGER_NAME).info(f'starting to deepen {bulk} cfs')
+
+    queried_data = db_handle.session.query(models.Cf).filter(*FILTERS).limit(bulk).all()
+    queried_data = [wire_utils.pack_cf(cf, False) for cf in queried_data]
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'size of batch is {len(queried_data)}')
+    return queried_data
+
+def summarize_results(results):
+    db_handle = ramanujan_db.RamanujanDB()
+    agg_deepened = 0
+    agg_passed = 0
+
+    logging.getLogger(LOGGER_NAME).info(f'Committing work')
+    for precision_datas, passed_pslq in results:
+        for record in precision_datas:
+            precision_data = wire_utils.unpack_precision(record)
+            precision_data.update_time = datetime.now()
+            db_handle.session.merge(precision_data)
+        try:
+            db_handle.session.commit()
+            agg_deepened += len(precision_datas)
+            agg_passed += passed_pslq
+            logging.getLogger(LOGGER_NAME).debug('sub commit happenned')
+        except Exception as ex:
+            logging.getLogger(LOGGER_NAME).info(f'There was an error while committing {ex}')
+            db_handle.session.rollback()
+
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'Commit done')
+
+    logging.getLogger(LOGGER_NAME).info(f'Deepened {agg_deepened} cfs, {agg_passed} of them passed the pslq precision')
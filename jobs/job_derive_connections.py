@@ -0,0 +1,120 @@
+import os
+import logging
+import logging.config
+from collections import deque
+
+import mpmath as mp
+from sqlalchemy.dialects import postgresql
+
+from db import models
+from db import ramanujan_db
+from jobs import job_const_cf_pslq
+from jobs.matrix_utils import mat_mul, mat_adj, mat_normalize
+
+LOGGER_NAME = 'job_logger'
+BULK_SIZE = 1000
+CONNECTION_TYPE = 'DERIVED'
+VERIFY_DPS = 50
+# the guard digits that the verification doesn't require to agree
+VERIFY_GUARD = 10
+MAX_COEFF = 2**31 - 1
+COMMIT_SIZE = 500
+
+# A connection (a, b, c, d) of cf x to the constant M means x = (a*M + b) / (c*M + d), and a
+# relation (a, b, c, d) from cf x to cf y means y = (a*x + b) / (c*x + d). So a cf that is
+# related to a connected cf is connected to the same constant through the product of the
+# matrices, or through the adjugate of the relation when it goes the other way.
+
+def get_relation_graph(relations):
+    """
+    The relations as an adjacency dict, graph[x][y] is the matrix that takes the value of
+    x to the value of y.
+    """
+    graph = {}
+    for source_cf, target_cf, details in relations:
+        matrix = tuple(details)
+        graph.setdefault(source_cf, {})[target_cf] = matrix
+        graph.setdefault(target_cf, {})[source_cf] = mat_adj(matrix)
+    return graph
+
+def derive_connections(connections, graph, bulk=BULK_SIZE):
+    """
+    Walks the relation graph from every connected cf, and returns up to bulk new connections
+    as a dict from (cf_id, constant_id) to the matrix that takes the constant to the cf.
+    """
+    known = {}
+    for cf_id, constant_id, details in connections:
+        known.setdefault(constant_id, {})[cf_id] = tuple(details)
+
+    derived = {}
+    for constant_id, cf_matrices in known.items():
+        queue = deque(cf_matrices.keys())
+        while queue and len(derived) < bulk:
+            cf_id = queue.popleft()
+            for neighbour, relation in graph.get(cf_id, {}).items():
+                if neighbour in cf_matrices:
+                    continue
+                matrix = mat_normalize(mat_mul(relation, cf_matrices[cf_id]))
+                if matrix[0] * matrix[3] - matrix[1] * matrix[2] == 0:
+                    continue
+                cf_matrices[neighbour] = matrix
+                queue.append(neighbour)
+                derived[(neighbour, constant_id)] = matrix
+    return derived
+
+def verify_connection(cf, constant, matrix):
+    a, b, c, d = matrix
+    with mp.workdps(min(VERIFY_DPS, cf.precision_data.precision, constant.precision)):
+        const_value = mp.mpf(str(constant.value))
+        cf_value = mp.mpf(str(cf.precision_data.previous_calc[2])) / mp.mpf(str(cf.precision_data.previous_calc[3]))
+        return mp.almosteq((a*const_value + b) / (c*const_value + d), cf_value, rel_eps=mp.mpf(10)**(VERIFY_GUARD - mp.mp.dps))
+
+def execute_job(bulk=0):
+    """
+    Adds the connections to constants that follow from the known connections and the cf to
+    cf relations, and marks their cfs as scanned by the const pslq job.
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'derive_connections_{os.getpid()}'})
+    if not bulk:
+        bulk = BULK_SIZE
+    db_handle = ramanujan_db.RamanujanDB()
+    connections = db_handle.session.query(models.CfConstantConnection.cf_id, models.CfConstantConnection.constant_id,
+            models.CfConstantConnection.connection_details).all()
+    relations = db_handle.session.query(models.ContinuedFractionRelation.source_cf, models.ContinuedFractionRelation.target_cf,
+            models.ContinuedFractionRelation.connection_details).all()
+    derived = derive_connections(connections, get_relation_graph(relations), bulk)
+    logging.getLogger(LOGGER_NAME).info(f'derived {len(derived)} connections from {len(connections)} connections and {len(relations)} relations')
+
+    job_const_cf_pslq.CONSTANT_CACHE.refresh(db_handle)
+    constants = {constant.constant_id: constant for constant in job_const_cf_pslq.CONSTANT_CACHE.constants}
+    added = 0
+    failed = 0
+    items = sorted(derived.items())
+    for i in range(0, len(items), COMMIT_SIZE):
+        batch = items[i:i + COMMIT_SIZE]
+        cfs = {cf.cf_id: cf for cf in db_handle.cfs.filter(models.Cf.cf_id.in_([cf_id for (cf_id, _), _ in batch]))}
+        rows = []
+        for (cf_id, constant_id), matrix in batch:
+            if max([abs(coeff) for coeff in matrix]) > MAX_COEFF:
+                logging.getLogger(LOGGER_NAME).info(f'connection of cf {cf_id} to constant {constant_id} is too big to store: {matrix}')
+                continue
+            cf = cfs[cf_id]
+            if not verify_connection(cf, constants[constant_id], matrix):
+                logging.getLogger(LOGGER_NAME).error(f'derived connection of cf {cf_id} to constant {constant_id} failed to verify: {matrix}')
+                failed += 1
+                continue
+            rows.append(dict(cf_id=cf_id, constant_id=constant_id, connection_type=CONNECTION_TYPE, connection_details=list(matrix)))
+            job_const_cf_pslq.mark_scanned(cf, job_const_cf_pslq.CONSTANT_CACHE)
+        try:
+            # const_cf_pslq might have found some of the connections in the meantime
+            if rows:
+                db_handle.session.execute(postgresql.insert(models.CfConstantConnection).values(rows).on_conflict_do_nothing())
+            db_handle.session.commit()
+            added += len(rows)
+        except Exception as ex:
+            logging.getLogger(LOGGER_NAME).info(f'There was an error while committing {ex}')
+            db_handle.session.rollback()
+
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'added {added} derived connections, {failed} failed to verify')
+    return added
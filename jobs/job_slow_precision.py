@@ -0,0 +1,86 @@
+import logging
+import logging.config
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy.sql.expression import func
+
+from db import ramanujan_db
+from db import models
+from jobs import job_calculate_precision
+from jobs import arith_backend
+from jobs import wire_utils
+
+LOGGER_NAME = 'job_logger'
+JOB_NAME = 'slow_precision'
+BULK_SIZE = 20
+
+# the cfs that ran out of their budget in the other precision jobs
+FILTERS = [
+        models.Cf.precision_data != None,
+        models.Cf.precision_data.has(models.CfPrecision.general_data['timed_out'].as_boolean()),
+        models.Cf.precision_data.has(func.cardinality(models.CfPrecision.previous_calc) == 4)
+        ]
+
+def execute_job(cfs):
+    """
+    Continues the cfs that timed out from the state they stopped at, with the budget of
+    the slow lane. A cf that didn't reach DEPTH yet goes on to DEPTH, a deeper one gets
+    another DEPTH steps.
+    """
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'slow_worker_{os.getpid()}'})
+    arith_backend.log_backend(LOGGER_NAME)
+    calc_config = job_calculate_precision.get_calc_config(JOB_NAME)
+    if calc_config['engine'] == job_calculate_precision.BATCH_ENGINE:
+        calc_config['engine'] = job_calculate_precision.ITERATIVE_ENGINE
+    results = []
+    timed_out = 0
+
+    for cf in [wire_utils.unpack_cf(cf) for cf in cfs]:
+        previous_calc, start_depth = job_calculate_precision.get_previous_calc(cf)
+        depth = job_calculate_precision.DEPTH - start_depth if start_depth < job_calculate_precision.DEPTH else job_calculate_precision.DEPTH
+        start_time = time.time()
+        result = job_calculate_precision.calculate_cf(cf.partial_numerator, cf.partial_denominator, depth, previous_calc, start_depth=start_depth, **calc_config)
+        logging.getLogger(LOGGER_NAME).debug(f'cf {cf.cf_id} went from depth {start_depth} to {result[4] + 1} in {time.time() - start_time} seconds')
+        timed_out += result[3]['timed_out']
+        results.append(wire_utils.pack_precision(job_calculate_precision.get_updated_precision(cf.precision_data, result)))
+
+    logging.getLogger(LOGGER_NAME).info(f'Done with {len(results)} slow cfs, {timed_out} of them timed out again')
+    return results, timed_out
+
+def run_query(bulk=0):
+    logging.config.fileConfig('logging.config', defaults={'log_filename': f'slow_manager'})
+    arith_backend.log_backend(LOGGER_NAME)
+    db_handle = ramanujan_db.RamanujanDB()
+
+    if not bulk:
+        bulk = BULK_SIZE
+
+    queried_data = db_handle.session.query(models.Cf).filter(*FILTERS).limit(bulk).all()
+    queried_data = [wire_utils.pack_cf(cf, False) for cf in queried_data]
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'size of slow batch is {len(queried_data)}')
+    return queried_data
+
+def summarize_results(results):
+    db_handle = ramanujan_db.RamanujanDB()
+    agg_done = 0
+    agg_timed_out = 0
+
+    logging.getLogger(LOGGER_NAME).info(f'Committing work')
+    for precision_datas, timed_out in results:
+        for record in precision_datas:
+            precision_data = wire_utils.unpack_precision(record)
+            precision_data.update_time = datetime.now()
+            db_handle.session.merge(precision_data)
+        try:
+            db_handle.session.commit()
+            agg_done += len(precision_datas)
+            agg_timed_out += timed_out
+        except Exception as ex:
+            logging.getLogger(LOGGER_NAME).info(f'There was an error while committing {ex}')
+            db_handle.session.rollback()
+
+    db_handle.session.close()
+    logging.getLogger(LOGGER_NAME).info(f'Slow lane worked on {agg_done} cfs, {agg_timed_out} of them timed out again')
@@ -0,0 +1,41 @@
+import math
+
+# 2x2 integer matrices are kept as row-major tuples (m00, m01, m10, m11)
+
+def mat_mul(first, second):
+    return (first[0]*second[0] + first[1]*second[2], first[0]*second[1] + first[1]*second[3],
+            first[2]*second[0] + first[3]*second[2], first[2]*second[1] + first[3]*second[3])
+
+def product_tree(matrices, start=0, end=None):
+    """
+    Multiplies matrices[start:end] by divide and conquer, so the big multiplications
+    are done between operands of similar size instead of one huge and one tiny operand.
+    """
+    if end is None:
+        end = len(matrices)
+    if end - start == 1:
+        return matrices[start]
+    if end - start == 2:
+        return mat_mul(matrices[start], matrices[start+1])
+    middle = (start + end) // 2
+    return mat_mul(product_tree(matrices, start, middle), product_tree(matrices, middle, end))
+
+def mat_adj(matrix):
+    """
+    The adjugate, which is the inverse up to the determinant, so it inverts the mobius
+    transform of the matrix.
+    """
+    return (matrix[3], -matrix[1], -matrix[2], matrix[0])
+
+def mat_normalize(matrix):
+    """
+    Takes the common factor out of the matrix and makes its first nonzero coefficient
+    positive, neither changes its mobius transform.
+    """
+    content = 0
+    for coeff in matrix:
+        content = math.gcd(content, coeff)
+    if content == 0:
+        return tuple(matrix)
+    sign = 1 if next(coeff for coeff in matrix if coeff != 0) > 0 else -1
+    return tuple([coeff // (content * sign) for coeff in matrix])
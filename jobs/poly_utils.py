@@ -0,0 +1,97 @@
+from collections import OrderedDict
+
+def calculate_poly_depth(coeff_list, n):
+    return sum([coeff*n**(len(coeff_list)-1-idx) for idx, coeff in enumerate(coeff_list)])
+
+class PolyIterator(object):
+    """
+    Iterates over the values of a polynomial at start, start+1, start+2, ...
+    The forward differences are computed once, after that every value costs
+    deg additions instead of a full evaluation.
+    """
+    def __init__(self, coeff_list, start=0):
+        self.n = start
+        values = [calculate_poly_depth(coeff_list, start + k) for k in range(max(len(coeff_list), 1))]
+        self.diffs = []
+        while values:
+            self.diffs.append(values[0])
+            values = [values[k+1] - values[k] for k in range(len(values) - 1)]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        value = self.diffs[0]
+        self.advance()
+        return value
+
+    @property
+    def value(self):
+        return self.diffs[0]
+
+    def advance(self):
+        diffs = self.diffs
+        for k in range(len(diffs) - 1):
+            diffs[k] += diffs[k+1]
+        self.n += 1
+
+def shift_poly(coeff_list, k):
+    """
+    Returns the coefficients of p(n + k), by Horner's rule on the polynomial n + k.
+    """
+    shifted = []
+    for coeff in coeff_list:
+        # shifted * (n + k) + coeff
+        shifted = [a + k*b for a, b in zip(shifted + [0], [0] + shifted)]
+        shifted[-1] += coeff
+    return shifted
+
+MAX_CACHED_VALUES = 1000000
+
+class SequenceCache(object):
+    """
+    LRU cache of the values of polynomials at 1, 2, 3, ... keyed by their coefficients,
+    so cfs that share a polynomial evaluate it once. Holds up to max_values values.
+    """
+    def __init__(self, max_values=MAX_CACHED_VALUES):
+        self.max_values = max_values
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # coefficients -> (values at 1..len(values), iterator at len(values) + 1)
+        self.sequences = OrderedDict()
+
+    def get_values(self, coeff_list, start, end):
+        """
+        Returns the values of the polynomial at start, start+1, ..., end-1, where start >= 1.
+        """
+        key = tuple(coeff_list)
+        if key in self.sequences:
+            self.sequences.move_to_end(key)
+            values, iterator = self.sequences[key]
+        else:
+            values, iterator = [], PolyIterator(coeff_list, 1)
+            self.sequences[key] = (values, iterator)
+
+        if len(values) >= end - 1:
+            self.hits += 1
+        else:
+            self.misses += 1
+            new_values = [next(iterator) for _ in range(end - 1 - len(values))]
+            values += new_values
+            self.size += len(new_values)
+            self.evict()
+        return values[start - 1:end - 1]
+
+    def evict(self):
+        # the newest sequence is kept even if it is bigger than the cache by itself
+        while self.size > self.max_values and len(self.sequences) > 1:
+            values, _ = self.sequences.popitem(last=False)[1]
+            self.size -= len(values)
+
+    @property
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+SEQUENCE_CACHE = SequenceCache()
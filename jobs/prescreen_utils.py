@@ -0,0 +1,138 @@
+import numpy as np
+
+PRESCREEN_DEPTH = 200
+EXACT_LIMIT = 2.0**53
+RENORMALIZE_LIMIT = 1e150
+SATURATION_PRECISION = 12
+SLOW_MARGIN = 2
+# the precision is sampled this many times along the run, to check that it is monotonic
+PRESCREEN_SAMPLES = 8
+
+# the relation screen looks for coefficients up to RELATION_COEFF, in blocks of pairs
+RELATION_COEFF = 12
+RELATION_BLOCK = 64
+RELATION_TOLERANCE = 1e-12
+
+SURVIVED = ''
+ZERO_DENOMINATOR = 'zero_denominator'
+DIVERGING = 'diverging'
+SLOW = 'slow'
+
+def get_coeff_matrix(coeff_lists):
+    width = max([len(coeffs) for coeffs in coeff_lists] + [1])
+    matrix = np.zeros((len(coeff_lists), width))
+    for row, coeffs in enumerate(coeff_lists):
+        if len(coeffs):
+            matrix[row, width - len(coeffs):] = [float(coeff) for coeff in coeffs]
+    return matrix
+
+def poly_values(coeff_matrix, n):
+    values = np.zeros(coeff_matrix.shape[0])
+    for col in range(coeff_matrix.shape[1]):
+        values = values * n + coeff_matrix[:, col]
+    return values
+
+def estimate_precision(p0, q0, p1, q1):
+    return -np.log10(np.abs(p1 / q1 - p0 / q0))
+
+def prescreen(nums, denoms, final_depth, precision_filter, depth=PRESCREEN_DEPTH):
+    """
+    Runs the recurrence of all of the cfs at once in float64, normalizing the state
+    whenever it grows too big, and flags the cfs that obviously won't reach
+    precision_filter at final_depth. A cf is only flagged as diverging or slow when
+    its precision moved monotonically along the run, since rounding can make the
+    precision of a good cf look like it drops.
+    Returns the outcome, estimated precision and value of every cf, an outcome of
+    SURVIVED means the cf has to be calculated exactly.
+    """
+    num_matrix = get_coeff_matrix(nums)
+    denom_matrix = get_coeff_matrix(denoms)
+    count = len(nums)
+
+    p0 = np.ones(count)
+    q0 = np.zeros(count)
+    p1 = poly_values(denom_matrix, 0)
+    q1 = np.ones(count)
+    # while every number in the recurrence is below 2^53 the float calculation is exact
+    exact = np.abs(p1) < EXACT_LIMIT
+    zero_denominator = np.zeros(count, dtype=bool)
+    half_precision = None
+    samples = []
+
+    with np.errstate(all='ignore'):
+        for n in range(1, depth + 1):
+            a = poly_values(num_matrix, n)
+            b = poly_values(denom_matrix, n)
+            terms = [b * p1, a * p0, b * q1, a * q0]
+            p = terms[0] + terms[1]
+            q = terms[2] + terms[3]
+            for term in terms + [a, b]:
+                exact &= np.abs(term) < EXACT_LIMIT
+            p0, q0, p1, q1 = p1, q1, p, q
+            # once two denominators in a row are 0 all of the next ones are too
+            zero_denominator |= exact & (q0 == 0) & (q1 == 0)
+
+            scale = np.maximum(np.maximum(np.abs(p0), np.abs(q0)), np.maximum(np.abs(p1), np.abs(q1)))
+            big = scale > RENORMALIZE_LIMIT
+            if big.any():
+                exact &= ~big
+                scale = np.where(big, scale, 1)
+                p0, q0, p1, q1 = p0 / scale, q0 / scale, p1 / scale, q1 / scale
+
+            if n == depth // 2:
+                half_precision = estimate_precision(p0, q0, p1, q1)
+            if n % max(depth // PRESCREEN_SAMPLES, 1) == 0:
+                samples.append(estimate_precision(p0, q0, p1, q1))
+
+        precision = estimate_precision(p0, q0, p1, q1)
+        values = p1 / q1
+        rate = (precision - half_precision) / (depth - depth // 2)
+        predicted = precision + np.maximum(rate, 0) * (final_depth - depth)
+        samples = np.array(samples)
+        steps = np.diff(samples, axis=0)
+        improving = np.all(steps >= 0, axis=0)
+        worsening = np.all(steps <= 0, axis=0)
+
+    outcomes = []
+    for i in range(count):
+        if zero_denominator[i]:
+            outcomes.append(ZERO_DENOMINATOR)
+        elif not np.isfinite(precision[i]) or not np.isfinite(half_precision[i]):
+            outcomes.append(SURVIVED)
+        elif worsening[i] and precision[i] < 0 and precision[i] < half_precision[i]:
+            outcomes.append(DIVERGING)
+        elif improving[i] and precision[i] < SATURATION_PRECISION and predicted[i] < precision_filter / SLOW_MARGIN:
+            outcomes.append(SLOW)
+        else:
+            outcomes.append(SURVIVED)
+
+    return outcomes, precision, values
+
+def get_relation_coeffs(max_coeff):
+    coeffs = np.arange(-max_coeff, max_coeff + 1, dtype=float)
+    a, c, d = [grid.ravel() for grid in np.meshgrid(coeffs, coeffs, coeffs, indexing='ij')]
+    nontrivial = (a != 0) | (c != 0) | (d != 0)
+    return a[nontrivial], c[nontrivial], d[nontrivial]
+
+def screen_relations(first_values, second_values, max_coeff=RELATION_COEFF, block_size=RELATION_BLOCK):
+    """
+    Looks for a relation a*x + b = y*(c*x + d) with integer coefficients up to max_coeff in
+    all of the (x, y) pairs at once in float64: for every a, c, d the b it takes has to be
+    an integer. Returns a boolean array of the pairs that might have such a relation, the
+    rest don't need pslq.
+    """
+    x = np.asarray(first_values, dtype=float)
+    y = np.asarray(second_values, dtype=float)
+    a, c, d = get_relation_coeffs(max_coeff)
+    tolerance = RELATION_TOLERANCE * max_coeff * (1 + np.abs(x)) * (1 + np.abs(y))
+    passed = np.zeros(len(x), dtype=bool)
+    with np.errstate(all='ignore'):
+        for start in range(0, len(x), block_size):
+            block_x = x[start:start + block_size, None]
+            block_y = y[start:start + block_size, None]
+            b = block_y * (c * block_x + d) - a * block_x
+            rounded = np.rint(b)
+            close = (np.abs(b - rounded) < tolerance[start:start + block_size, None]) & (np.abs(rounded) <= max_coeff)
+            # a pair that isn't finite in float64 can't be screened, so it goes on to pslq
+            passed[start:start + block_size] = close.any(axis=1) | ~np.isfinite(block_x[:, 0] * block_y[:, 0])
+    return passed
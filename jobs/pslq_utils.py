@@ -1,5 +1,17 @@
+import math
+import logging
+from collections import Counter
+
 import mpmath as mp
 
+MAX_COEFF = 1000
+MIN_SCREEN_DPS = 30
+# digits of the screening tier per digit of the coefficient bound and per element of the vector
+SCREEN_FACTOR = 3
+TIER_FACTOR = 8
+
+# per tier, how many pairs had a candidate relation there and how many were rejected
+TIER_STATS = Counter()
 
 def verify_result(first_value, second_value, result):
     right_side = second_value
@@ -11,8 +23,8 @@ def verify_result(first_value, second_value, result):
         print("False positive")
         return None
 
-def check_int_null_vector(first_value, second_value):
-    result = mp.pslq([first_value, 1, -second_value*first_value, -second_value])
+def check_int_null_vector(first_value, second_value, max_coeff=MAX_COEFF):
+    result = mp.pslq([first_value, 1, -second_value*first_value, -second_value], maxcoeff=max_coeff)
 
     # Verify: denote the math const as M and the CF value as cf then the result we seek is:
     # (a*M + b) / (c*M + d) = cf
@@ -23,3 +35,37 @@ def check_int_null_vector(first_value, second_value):
 
     return None
 
+def get_tiers(dps, max_coeff=MAX_COEFF):
+    """
+    The working precisions of the tiered check, from a screening precision that is enough
+    to rule out relations with coefficients up to max_coeff, up to dps.
+    """
+    tier = max(MIN_SCREEN_DPS, 4 * math.ceil(math.log10(max_coeff)) * SCREEN_FACTOR)
+    tiers = []
+    while tier < dps:
+        tiers.append(tier)
+        tier *= TIER_FACTOR
+    return tiers + [dps]
+
+def check_int_null_vector_tiered(first_value, second_value, max_coeff=MAX_COEFF):
+    """
+    Same as check_int_null_vector at the current precision, but pslq runs at the low tiers
+    first and escalates only when it finds a candidate relation there. The values should
+    carry the full precision, every tier rounds them to its own.
+    """
+    tiers = get_tiers(mp.mp.dps, max_coeff)
+    for tier, dps in enumerate(tiers[:-1]):
+        with mp.workdps(dps):
+            if not mp.pslq([first_value, 1, -second_value*first_value, -second_value], maxcoeff=max_coeff):
+                TIER_STATS[(tier, 'rejected')] += 1
+                return None
+        TIER_STATS[(tier, 'candidate')] += 1
+
+    result = check_int_null_vector(first_value, second_value, max_coeff)
+    TIER_STATS[(len(tiers) - 1, 'found' if result else 'rejected')] += 1
+    return result
+
+def log_tier_stats(logger_name):
+    for (tier, outcome), count in sorted(TIER_STATS.items()):
+        logging.getLogger(logger_name).info(f'pslq tier {tier}: {count} {outcome}')
+    TIER_STATS.clear()
@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+from db import models
+
+# The cfs go from the manager to the workers, and their precision data back, as these
+# records instead of orm objects. The big integers of the state are packed as bytes, which
+# pickle to about half of the size of their decimal strings, and the value of the precision
+# data is only sent back, since the workers don't read it.
+
+WireCf = namedtuple('WireCf', ['cf_id', 'partial_numerator', 'partial_denominator', 'precision_data', 'canonical_id', 'canonical',
+    'canonical_transform', 'scanned_algo'])
+WirePrecision = namedtuple('WirePrecision', ['cf_id', 'depth', 'precision', 'value', 'previous_calc', 'general_data'])
+
+def pack_int(x):
+    x = int(x)
+    return x.to_bytes(x.bit_length() // 8 + 1, 'big', signed=True)
+
+def unpack_int(data):
+    return int.from_bytes(data, 'big', signed=True)
+
+def pack_precision(precision_data, with_value=True):
+    if precision_data is None:
+        return None
+    return WirePrecision(precision_data.cf_id, precision_data.depth, precision_data.precision, precision_data.value if with_value else None,
+            tuple([pack_int(x) for x in precision_data.previous_calc or []]), precision_data.general_data)
+
+def unpack_precision(record):
+    """
+    Makes the orm object of a packed precision data, to be written to the db.
+    """
+    return models.CfPrecision(cf_id=record.cf_id, depth=record.depth, precision=record.precision, value=record.value,
+            previous_calc=[str(unpack_int(x)) for x in record.previous_calc], general_data=record.general_data)
+
+def pack_cf(cf, with_canonical=True):
+    canonical = pack_cf(cf.canonical, False) if with_canonical and cf.canonical_id and cf.canonical else None
+    return WireCf(cf.cf_id, tuple([int(coeff) for coeff in cf.partial_numerator]), tuple([int(coeff) for coeff in cf.partial_denominator]),
+            pack_precision(cf.precision_data, False), cf.canonical_id, canonical, cf.canonical_transform, cf.scanned_algo)
+
+def unpack_cf(record):
+    """
+    Unpacks the state of a cf (and of its canonical form) in the worker. The result has the
+    attributes of the orm cf that the jobs read, with previous_calc as a list of ints.
+    """
+    if record is None:
+        return None
+    precision_data = record.precision_data
+    if precision_data is not None:
+        precision_data = precision_data._replace(previous_calc=[unpack_int(x) for x in precision_data.previous_calc])
+    return record._replace(precision_data=precision_data, canonical=unpack_cf(record.canonical))
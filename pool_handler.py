@@ -7,17 +7,21 @@ import os
 import logging
 import logging.config
 import threading
+import queue
 
 LOGGER_NAME = 'job_logger'
 
 COOLDOWN = 'cooldown'
 DEFAULT_COOLDOWN = 1
+# how long the dispatcher blocks on the job queue before it checks again whether to stop
+QUEUE_TIMEOUT = 1
 
 @dataclass
 class Message:
     is_kill_message: bool
     module_path: str
     parameters: list
+    sent_time: float = 0
 
     @staticmethod
     def get_kill_message():
@@ -25,14 +29,14 @@ class Message:
 
     @staticmethod
     def get_execution_message(module_path, parameters):
-        return Message(False, module_path, parameters)
+        return Message(False, module_path, parameters, time.time())
 
 def import_module(module_path):
     return importlib.import_module(module_path)
 
-def callback_wrapper(queue):
+def callback_wrapper(result_queue):
     def callback(result):
-        queue.put(result)
+        result_queue.put(result)
     return callback
 
 class WorkerPool:
@@ -47,6 +51,7 @@ class WorkerPool:
             self.pool = Pool()
         self.result_queues = {}
         self.main_jobs = 0
+        self.dispatch_latencies = {}
 
     def stop(self):
         self.running.value = 0
@@ -70,9 +75,10 @@ class WorkerPool:
 
     def read_queue(self):
         while self.main_jobs != 0:
-            while self.job_queue.empty():
-                time.sleep(2)
-            message = self.job_queue.get()
+            try:
+                message = self.job_queue.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
 
             if message.is_kill_message:
                 self.main_jobs -= 1
@@ -81,9 +87,16 @@ class WorkerPool:
 
             else:
                 self.pool.apply_async(WorkerPool.run_sub_job, (message.module_path, message.parameters), callback=callback_wrapper(self.result_queues[message.module_path]))
+                self.dispatch_latencies.setdefault(message.module_path, []).append(time.time() - message.sent_time)
+        self.log_latencies()
         self.pool.close()
         self.pool.join()
 
+    def log_latencies(self):
+        for module_path, latencies in self.dispatch_latencies.items():
+            logging.getLogger(LOGGER_NAME).info(f'module {module_path} dispatched {len(latencies)} chunks, '
+                    f'average latency {sum(latencies) / len(latencies):.4f} seconds, max latency {max(latencies):.4f} seconds')
+
     @staticmethod
     def run_module(module, module_path, job_queue, result_queue, run_async, async_cores, split_async, args):
         try:
@@ -1,6 +1,7 @@
 from decimal import Decimal, getcontext
 getcontext().prec = 2000
 import math
+from jobs.poly_utils import PolyIterator
 
 def calculate_depth(coeff_list, n):
     return sum([coeff*n**(len(coeff_list)-1-idx) for idx, coeff in enumerate(coeff_list)])
@@ -28,9 +29,11 @@ def calculate_mat(num, denom, depth):
     A_2 = calculate_depth(denom, 0)
     B_2 = 1
 
+    num_iter = PolyIterator(num, 1)
+    denom_iter = PolyIterator(denom, 1)
     for i in range(depth-1):
-        a = calculate_depth(num, i+1)
-        b = calculate_depth(denom, i+1)
+        a = next(num_iter)
+        b = next(denom_iter)
         
         A_3 = b*A_2 + a*A_1
         B_3 = b*B_2 + a*B_1
@@ -48,9 +51,11 @@ def calculate_mat2(num, denom, depth):
     a_1 = calculate_depth(denom, 0)
     b_1 = 1
 
+    num_iter = PolyIterator(num, 1)
+    denom_iter = PolyIterator(denom, 1)
     for i in range(depth-1):
-        a = calculate_depth(num, i+1)
-        b = calculate_depth(denom, i+1)
+        a = next(num_iter)
+        b = next(denom_iter)
         
         p = b*a_1 + a*a_0
         q = b*b_1 + a*b_0
@@ -0,0 +1,182 @@
+from jobs.poly_utils import PolyIterator, SequenceCache, calculate_poly_depth
+from jobs import job_calculate_precision as prec_job
+from jobs import canonical_utils
+from jobs import pslq_utils
+from jobs import prescreen_utils
+from jobs import fingerprint_utils
+from jobs import job_derive_connections
+from jobs import job_const_cf_pslq
+from jobs import job_cf_to_cf_pslq
+from jobs import wire_utils
+import numpy as np
+import unittest
+from unittest import mock
+import math
+
+
+class TestCfCalc(unittest.TestCase):
+    def test_poly_iterator(self):
+        for coeffs in [[], [7], [3, -2], [-2, 0, 5, -7], [1, 0, 0, 0, 0, -1]]:
+            values = PolyIterator(coeffs, 3)
+            for n in range(3, 50):
+                self.assertEqual(next(values), calculate_poly_depth(coeffs, n))
+
+    def test_sequence_cache(self):
+        cache = SequenceCache(150)
+        for coeffs in [[1, 2, 3], [4, 5], [1, 2, 3], [-1, 0, 0, 7]]:
+            self.assertEqual(cache.get_values(coeffs, 20, 60), [calculate_poly_depth(coeffs, n) for n in range(20, 60)])
+        self.assertEqual(cache.hits, 1)
+        self.assertLessEqual(cache.size, 150)
+
+    def test_poly_values_restart(self):
+        cf_calc = prec_job.CfCalc([1, 2, 3], [4, 5], None)
+        self.assertEqual(cf_calc.poly_values(1), (6, 9))
+        self.assertEqual(cf_calc.poly_values(10), (123, 45))
+        self.assertEqual(cf_calc.poly_values(11), (146, 49))
+
+    def test_binary_split_engine(self):
+        for num, denom in [([1], [1]), ([-2, 3, 5, -7], [1, 1]), ([-1, 0, 0, 0, 0, 0, 0], [34, 51, 27, 5])]:
+            iterative = prec_job.CfCalc(num, denom, None, prec_job.ITERATIVE_ENGINE)
+            binary_split = prec_job.CfCalc(num, denom, None, prec_job.BINARY_SPLIT_ENGINE)
+            for start, end in [(0, 1), (1, 100), (100, 101), (101, 350)]:
+                self.assertEqual(iterative.calc_range(start, end), binary_split.calc_range(start, end))
+                self.assertEqual(iterative.get_calc_data(), binary_split.get_calc_data())
+            self.assertEqual(iterative.reduction, binary_split.reduction)
+
+    def test_batch_engine(self):
+        nums = [[1, 2, 3], [-2, 5, 1], [4, 0, -1]]
+        denoms = [[1, 1], [3, 2], [2, 5]]
+        results = prec_job.calculate_cf_batch(nums, denoms, 450)
+        for num, denom, result in zip(nums, denoms, results):
+            self.assertEqual(prec_job.calculate_cf(num, denom, 450)[1:], result[1:])
+
+    def test_resume(self):
+        num, denom = [-1, 0, 0], [3, 1]
+        full = prec_job.calculate_cf(num, denom, 1200)
+        first = prec_job.calculate_cf(num, denom, 600)
+        resumed = prec_job.calculate_cf(num, denom, 600, first[2], start_depth=first[3]['calc_depth'])
+        self.assertEqual(full[:3], resumed[:3])
+        self.assertEqual(full[4], resumed[4])
+        self.assertEqual(resumed[3]['calc_depth'], 1200)
+
+    def test_canonical_form(self):
+        for num, denom in [([-18, -36, 18, -45, 9], [-12, -12, 15]), ([36, 180, 207], [-3, -15]), ([0, 1, 11, 22], [-4, -7])]:
+            canonical_num, canonical_denom, scale, shift = canonical_utils.canonicalize(num, denom)
+            self.assertEqual(canonical_utils.canonicalize(canonical_num, canonical_denom), (canonical_num, canonical_denom, 1, 0))
+            canonical_result = prec_job.calculate_cf(canonical_num, canonical_denom, 300)
+            calc_data = canonical_utils.derive_calc(canonical_num, canonical_denom, scale, shift, canonical_result[2])
+            result = prec_job.calculate_cf(num, denom, canonical_result[3]['calc_depth'] + shift)
+            self.assertIn(result[2], [calc_data, [-x for x in calc_data]])
+
+    def test_metrics(self):
+        # 1 + sqrt(2) is a quadratic irrational, so its irrationality measure is 1
+        general_data = prec_job.calculate_cf([1], [2], 1200)[3]
+        self.assertAlmostEqual(general_data['delta'], 1, places=2)
+        self.assertAlmostEqual(general_data['lambda_'], 2 * math.log10(1 + math.sqrt(2)), places=2)
+        # the rate estimated up front from the leading coefficients agrees with the measured one
+        self.assertAlmostEqual(general_data['convergence_rate'], general_data['lambda_'], places=2)
+
+    def test_zero_state(self):
+        # p = q = 0 at a checkpoint has no gcd to reduce
+        self.assertEqual(prec_job.calculate_cf([1, -201], [1, -201], 1200)[1], 2000)
+        self.assertEqual(prec_job.calculate_cf_batch([[1, -201]], [[1, -201]], 1200)[0][1], 2000)
+
+    def test_stop_reason(self):
+        self.assertEqual(prec_job.get_stop_reason([10, 40, 2500], 2000), prec_job.StopReason.TARGET_PRECISION)
+        self.assertEqual(prec_job.get_stop_reason([-1, -2, -3], 2000), prec_job.StopReason.DIVERGING)
+        self.assertEqual(prec_job.get_stop_reason([3, 3.2, 3.4, 3.5], 2000), prec_job.StopReason.STAGNANT)
+        self.assertIsNone(prec_job.get_stop_reason([3, 30, 60, 90], 2000))
+
+    def test_tiered_pslq(self):
+        with pslq_utils.mp.workdps(600):
+            const = pslq_utils.mp.sqrt(7)
+            for cf_value in [(3*const - 2) / (5*const + 1), pslq_utils.mp.zeta(3)]:
+                self.assertEqual(pslq_utils.check_int_null_vector_tiered(const, cf_value), pslq_utils.check_int_null_vector(const, cf_value))
+
+    def test_fingerprint_index(self):
+        index = fingerprint_utils.FingerprintIndex(1)
+        with pslq_utils.mp.workdps(60):
+            values = [pslq_utils.mp.sqrt(n) for n in [2, 3, 5, 7]]
+            related = (2*values[1] - 1) / (values[1] + 2)
+        for key, value in enumerate(values):
+            index.add(key, value)
+        self.assertEqual(index.find(related, fingerprint_utils.get_transforms(2)), {1})
+
+    def test_prescreen(self):
+        # cfs whose float precision drops along the run because of rounding, but that converge well
+        nums, denoms = [[2, 4, 10, -4, -47, 24, -3], [13, 23, -2], [37, 44, 4]], [[1, -48, 49, -5], [1, -38], [1, -45]]
+        self.assertEqual(prescreen_utils.prescreen(nums, denoms, prec_job.DEPTH, prec_job.PRECISION_FILTER)[0], [prescreen_utils.SURVIVED] * 3)
+        # random cfs like generate_cfs_random makes, with a numerator of twice the degree of the denominator
+        random = np.random.RandomState(1)
+        cfs = []
+        for deg in random.randint(0, 4, 1000):
+            num, denom = list(random.randint(-50, 50, 2*deg + 1)), list(random.randint(-50, 50, deg + 1))
+            if num[0] and denom[0]:
+                cfs.append((num, denom))
+        outcomes = prescreen_utils.prescreen([num for num, _ in cfs], [denom for _, denom in cfs], prec_job.DEPTH, prec_job.PRECISION_FILTER)[0]
+        flagged = [cf for cf, outcome in zip(cfs, outcomes) if outcome != prescreen_utils.SURVIVED]
+        self.assertTrue(flagged)
+        for num, denom in flagged:
+            value, precision = prec_job.calculate_cf(num, denom, prec_job.DEPTH)[:2]
+            self.assertTrue(value == math.inf or precision < prec_job.PRECISION_FILTER)
+
+    def test_relation_screen(self):
+        x = [math.sqrt(2), math.pi, math.e]
+        y = [(3*x[0] - 1) / (x[0] + 4), math.log(3), (x[2] + 7) / (-2*x[2] + 5)]
+        self.assertEqual(list(prescreen_utils.screen_relations(x, y)), [True, False, True])
+
+    def test_derive_connections(self):
+        with pslq_utils.mp.workdps(300):
+            const = pslq_utils.mp.zeta(3)
+            first = (2*const + 1) / (const - 3)
+            second = (first + 2) / (3*first - 1)
+            connection = pslq_utils.check_int_null_vector(const, first)
+            relation = pslq_utils.check_int_null_vector(second, first)
+            graph = job_derive_connections.get_relation_graph([(2, 1, relation)])
+            a, b, c, d = job_derive_connections.derive_connections([(1, 7, connection)], graph)[(2, 7)]
+            self.assertTrue(pslq_utils.mp.almosteq((a*const + b) / (c*const + d), second))
+
+    def test_unchecked_constants(self):
+        constants = [job_const_cf_pslq.CachedConstant(constant_id, '', 100, '2', insertion_time) for constant_id, insertion_time in [(1, 100), (2, 200), (5, 900)]]
+        for scanned_algo, unchecked in [(None, [1, 2, 5]), ({job_const_cf_pslq.ALGORITHM_NAME: 500}, [5]),
+                ({job_const_cf_pslq.ALGORITHM_NAME: 1000, job_const_cf_pslq.VERSION_KEY: 1}, [2, 5])]:
+            cf = prec_job.models.Cf(scanned_algo=scanned_algo)
+            self.assertEqual([const.constant_id for const in job_const_cf_pslq.get_unchecked_constants(cf, constants)], unchecked)
+
+    @mock.patch('logging.config.fileConfig')
+    def test_cf_to_cf_tiles(self, _):
+        with pslq_utils.mp.workdps(300):
+            values = [pslq_utils.mp.pi, (3*pslq_utils.mp.pi + 1) / (pslq_utils.mp.pi - 2), pslq_utils.mp.zeta(3)]
+            cfs = [job_cf_to_cf_pslq.CfRecord(cf_id, 200, str(int(value * 10**250)), str(10**250), 0, None) for cf_id, value in enumerate(values)]
+        tiles = [job_cf_to_cf_pslq.Tile([cf], cfs, frozenset([0, 1])) for cf in cfs[:2]]
+        expected = ([0], [(0, 1, [3, 1, 1, -2])])
+        self.assertEqual(job_cf_to_cf_pslq.execute_job(tiles[0]), expected)
+        # the pool sends a list of tiles when it splits them into chunks
+        self.assertEqual(job_cf_to_cf_pslq.execute_job(tiles), ([0, 1], expected[1]))
+
+    def test_wire_format(self):
+        for x in [0, 1, -1, 127, 128, -128, -129, 3**1000, -7**500]:
+            self.assertEqual(wire_utils.unpack_int(wire_utils.pack_int(x)), x)
+        cf = prec_job.models.Cf(cf_id=3, partial_numerator=[1, 0, -2], partial_denominator=[3, 1], canonical_id=None)
+        previous_calc = prec_job.calculate_cf(cf.partial_numerator, cf.partial_denominator, 300)[2]
+        cf.precision_data = prec_job.models.CfPrecision(cf_id=3, depth=299, precision=50, value=0, previous_calc=[str(x) for x in previous_calc])
+        record = wire_utils.unpack_cf(wire_utils.pack_cf(cf))
+        self.assertEqual(record.precision_data.previous_calc, [int(x) for x in previous_calc])
+        self.assertEqual(wire_utils.unpack_precision(wire_utils.pack_precision(cf.precision_data)).previous_calc, cf.precision_data.previous_calc)
+
+    @mock.patch('logging.config.fileConfig')
+    def test_execute_job(self, _):
+        num, denom = [2, 0, -4], [6, 2]
+        canonical_num, canonical_denom, scale, shift = canonical_utils.canonicalize(num, denom)
+        canonical = prec_job.models.Cf(cf_id=1, partial_numerator=canonical_num, partial_denominator=canonical_denom, canonical_id=None)
+        cf = prec_job.models.Cf(cf_id=2, partial_numerator=num, partial_denominator=denom, canonical_id=1,
+                canonical_transform={'scale': scale, 'shift': shift})
+        results, _ = prec_job.execute_job([wire_utils.pack_cf(canonical)])
+        canonical.precision_data = wire_utils.unpack_precision(results[0])
+        self.assertEqual(canonical.precision_data.precision, prec_job.calculate_cf(canonical_num, canonical_denom, prec_job.DEPTH)[1])
+        cf.canonical = canonical
+        results, _ = prec_job.execute_job([wire_utils.pack_cf(cf)])
+        self.assertEqual(wire_utils.unpack_precision(results[0]).general_data['derived_from'], '1')
+
+if __name__ == '__main__':
+    unittest.main()
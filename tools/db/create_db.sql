@@ -34,6 +34,8 @@ CREATE TABLE cf (
 	partial_numerator NUMERIC[] NOT NULL,
 	partial_denominator NUMERIC[] NOT NULL,
 	scanned_algo JSONB,
+	canonical_id UUID REFERENCES cf (cf_id),
+	canonical_transform JSONB,
 
 	UNIQUE(partial_numerator, partial_denominator),
 	family_id UUID REFERENCES cf_family (family_id)
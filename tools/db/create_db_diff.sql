@@ -18,3 +18,7 @@ CREATE TABLE cf_precision (
 	interesting NUMERIC DEFAULT 0,
 	update_time timestamp DEFAULT current_timestamp
 );
+
+ALTER TABLE cf
+	ADD COLUMN canonical_id UUID REFERENCES cf (cf_id),
+	ADD COLUMN canonical_transform JSONB;